@@ -2,8 +2,8 @@ from django.contrib import admin
 from django.contrib.auth import get_user_model
 
 from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeTag,
-                            Subscription, Tag, UserFavoriteRecipes,
-                            UserShoppingCart)
+                            ShoppingListItem, Subscription, Tag,
+                            UserFavoriteRecipes, UserShoppingCart)
 
 User = get_user_model()
 
@@ -14,7 +14,7 @@ class IngredientAdmin(admin.ModelAdmin):
 
 
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ("pk", "name", "author", "get_favorited_count")
+    list_display = ("pk", "name", "author", "favorites_count")
     search_fields = (
         "author__first_name",
         "author__first_name",
@@ -23,11 +23,6 @@ class RecipeAdmin(admin.ModelAdmin):
     )
     list_filter = ("tags",)
 
-    def get_favorited_count(self, obj):
-        return UserFavoriteRecipes.objects.filter(recipe=obj).count()
-
-    get_favorited_count.short_description = "Число добавлений в избранное"
-
 
 class UserAdmin(admin.ModelAdmin):
     list_display = ("pk", "username", "first_name", "last_name", "email")
@@ -39,6 +34,7 @@ admin.site.register(Recipe, RecipeAdmin)
 admin.site.register(Ingredient, IngredientAdmin)
 admin.site.register(RecipeIngredient)
 admin.site.register(RecipeTag)
+admin.site.register(ShoppingListItem)
 admin.site.register(Subscription)
 admin.site.register(Tag)
 admin.site.register(UserFavoriteRecipes)
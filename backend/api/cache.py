@@ -0,0 +1,210 @@
+import threading
+import time
+from collections import Counter
+from functools import wraps
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db import connection
+from rest_framework import status
+from rest_framework.response import Response
+
+RECIPES_VERSION = "recipes:version"
+RELATED_VERSION = "recipes:related:version"
+RECIPE_VERSION = "recipe:{}:version"
+RECIPE_BODY = "recipe:{}:body:{}:{}"
+INGREDIENTS_VERSION = "ingredients:version"
+TAGS_VERSION = "tags:version"
+PANTRY_VERSION = "pantry:version"
+PANTRY_CHANGE = "pantry:change:{}"
+SHORT_LINK = "short-link:{}"
+# Попадания и промахи считаются в памяти процесса и не чаще раза в
+# STATS_FLUSH_INTERVAL секунд переносятся в последовательности PostgreSQL:
+# nextval атомарен, в отличие от incr файлового кэша. В остальных базах
+# статистика остаётся в памяти процесса.
+HITS = "response_cache_hits_seq"
+MISSES = "response_cache_misses_seq"
+STATS_FLUSH_INTERVAL = 1
+LIST_PARAMS = (
+    "page",
+    "limit",
+    "cursor",
+    "tags",
+    "author",
+    "is_favorited",
+    "is_in_shopping_cart",
+    "search",
+)
+
+
+def get_versions(*keys):
+    """
+    Возвращает текущие версии по ключам. Отсутствующая (или вытесненная)
+    версия заводится по текущему времени, чтобы не совпасть ни с одной
+    из уже выданных.
+    """
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def bump_versions(*keys):
+    for key in keys:
+        bump_version(key)
+
+
+def invalidate_recipe(pk):
+    bump_versions(RECIPES_VERSION, RECIPE_VERSION.format(pk))
+
+
+def invalidate_recipes():
+    bump_versions(RECIPES_VERSION, RELATED_VERSION)
+
+
+def invalidate_author_recipes(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        bump_versions(
+            RECIPES_VERSION, *(RECIPE_VERSION.format(pk) for pk in recipe_ids)
+        )
+
+
+def recipe_list_key(request, *args, **kwargs):
+    params = request.query_params
+    query = "&".join(
+        f"{name}={','.join(sorted(params.getlist(name)))}"
+        for name in LIST_PARAMS
+        if name in params
+    )
+    version, = get_versions(RECIPES_VERSION)
+    return __make_key("list", version, request.get_host(), query)
+
+
+def recipe_detail_key(request, *args, **kwargs):
+    pk = kwargs["pk"]
+    version, related_version = get_versions(
+        RECIPE_VERSION.format(pk), RELATED_VERSION
+    )
+    return __make_key("detail", version, related_version, pk)
+
+
+def get_recipe_bodies(pks, build):
+    """
+    Возвращает общие для всех пользователей представления рецептов
+    {pk: data}. Промахи достраиваются вызовом build(pks) и кэшируются
+    до смены версии рецепта или связанных с ним данных.
+    """
+    *versions, related_version = get_versions(
+        *(RECIPE_VERSION.format(pk) for pk in pks), RELATED_VERSION
+    )
+    keys = {
+        pk: RECIPE_BODY.format(pk, version, related_version)
+        for pk, version in zip(pks, versions)
+    }
+    cached = cache.get_many(keys.values())
+    bodies = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [pk for pk in pks if pk not in bodies]
+    if missing:
+        built = build(missing)
+        cache.set_many({keys[pk]: body for pk, body in built.items()})
+        bodies.update(built)
+    return bodies
+
+
+def resolve_short_link(link, resolve):
+    """
+    Возвращает id рецепта по коду короткой ссылки. Код рецепта не
+    меняется, поэтому соответствие хранится до удаления ссылки.
+    """
+    key = SHORT_LINK.format(link)
+    recipe_id = cache.get(key)
+    if recipe_id is None:
+        recipe_id = resolve(link)
+        if recipe_id is not None:
+            cache.set(key, recipe_id, timeout=None)
+    return recipe_id
+
+
+def forget_short_link(link):
+    cache.delete(SHORT_LINK.format(link))
+
+
+__pending = Counter()
+__pending_lock = threading.Lock()
+__flushed_at = 0
+
+
+def get_stats():
+    with __pending_lock:
+        stats = Counter(__pending)
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            for sequence in (HITS, MISSES):
+                cursor.execute(
+                    f"SELECT CASE WHEN is_called THEN last_value ELSE 0 END "
+                    f"FROM {sequence}"
+                )
+                stats[sequence] += cursor.fetchone()[0]
+    return {"hits": stats[HITS], "misses": stats[MISSES]}
+
+
+def cache_anonymous_response(key_func):
+    """
+    Кэширует данные успешного ответа для анонимных пользователей по ключу,
+    который строит key_func из запроса и аргументов представления.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(view, request, *args, **kwargs):
+            if request.user.is_authenticated:
+                return method(view, request, *args, **kwargs)
+            key = key_func(request, *args, **kwargs)
+            data = cache.get(key)
+            if data is not None:
+                __count(HITS)
+                return Response(data)
+            __count(MISSES)
+            response = method(view, request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                cache.set(key, response.data)
+            return response
+        return wrapper
+    return decorator
+
+
+def __make_key(kind, *parts):
+    digest = md5(":".join(map(str, parts)).encode("utf-8")).hexdigest()
+    return f"response:recipes:{kind}:{digest}"
+
+
+def __count(sequence):
+    global __flushed_at
+    with __pending_lock:
+        __pending[sequence] += 1
+        now = time.monotonic()
+        if (
+            connection.vendor != "postgresql"
+            or now - __flushed_at < STATS_FLUSH_INTERVAL
+        ):
+            return
+        pending = dict(__pending)
+        __pending.clear()
+        __flushed_at = now
+    with connection.cursor() as cursor:
+        for sequence, count in pending.items():
+            cursor.execute(
+                "SELECT count(nextval(%s)) FROM generate_series(1, %s)",
+                (sequence, count),
+            )
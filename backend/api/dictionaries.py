@@ -0,0 +1,163 @@
+import gzip
+from bisect import bisect_left
+from hashlib import sha1
+from threading import Lock
+
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+from recipes.models import Ingredient, Tag
+from .cache import INGREDIENTS_VERSION, TAGS_VERSION, get_versions
+
+
+def normalize_name(name):
+    return name.casefold().replace("ё", "е")
+
+
+class LocalDictionary:
+    """
+    Данные справочника, которые хранятся в памяти процесса и
+    перестраиваются при смене версии справочника в общем кэше.
+    """
+    version_key = None
+
+    def __init__(self):
+        self.version = None
+        self.lock = Lock()
+
+    def refresh(self):
+        version, = get_versions(self.version_key)
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.build()
+                    self.version = version
+        return self
+
+    def build(self):
+        raise NotImplementedError
+
+
+class IngredientIndex(LocalDictionary):
+    """
+    Отсортированный по нормализованному названию индекс ингредиентов
+    для поиска по префиксу.
+    """
+    version_key = INGREDIENTS_VERSION
+
+    def search(self, prefix, limit=None):
+        self.refresh()
+        keys, items = self.keys, self.items
+        prefix = normalize_name(prefix)
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + chr(0x10FFFF), lo=start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return items[start:end]
+
+    def build(self):
+        rows = sorted(
+            (normalize_name(name), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                "id", "name", "measurement_unit"
+            )
+        )
+        self.keys = [row[0] for row in rows]
+        self.items = [
+            {"id": pk, "name": name, "measurement_unit": measurement_unit}
+            for _, pk, name, measurement_unit in rows
+        ]
+
+
+class KnownIds(LocalDictionary):
+    """
+    Множество id записей справочника для проверки ссылок без запросов к
+    базе. Если задано key_field, хранит и соответствие ключ -> id.
+    """
+
+    def __init__(self, version_key, queryset, key_field=None):
+        super().__init__()
+        self.version_key = version_key
+        self.queryset = queryset
+        self.key_field = key_field
+
+    def build(self):
+        if self.key_field is None:
+            self.ids = frozenset(self.queryset.values_list("id", flat=True))
+            self.by_key = {}
+            return
+        self.by_key = dict(
+            self.queryset.values_list(self.key_field, "id")
+        )
+        self.ids = frozenset(self.by_key.values())
+
+    def contains(self, ids):
+        """
+        Проверяет, что все переданные id существуют.
+        """
+        self.refresh()
+        try:
+            return self.ids.issuperset(int(pk) for pk in ids)
+        except (TypeError, ValueError):
+            return False
+
+    def keys(self):
+        return list(self.refresh().by_key)
+
+    def resolve(self, keys):
+        by_key = self.refresh().by_key
+        return [by_key[key] for key in keys if key in by_key]
+
+
+class DictionarySnapshot(LocalDictionary):
+    """
+    Готовый JSON всего справочника (обычный и сжатый) со строгим ETag.
+    """
+
+    def __init__(self, version_key, queryset, fields):
+        super().__init__()
+        self.version_key = version_key
+        self.queryset = queryset
+        self.fields = fields
+
+    def build(self):
+        items = list(self.queryset.order_by("id").values(*self.fields))
+        body = JSONRenderer().render(items)
+        self.items = items
+        self.body = body
+        self.gzipped_body = gzip.compress(body)
+        digest = sha1(body).hexdigest()
+        self.etag = f'"{digest}"'
+        # Строгий валидатор различается для каждой кодировки содержимого.
+        self.gzipped_etag = f'"{digest}-gzip"'
+
+    def response(self, request):
+        self.refresh()
+        gzipped = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+        etag = self.gzipped_etag if gzipped else self.etag
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            response = not_modified
+        elif gzipped:
+            response = HttpResponse(
+                self.gzipped_body, content_type="application/json"
+            )
+            response["Content-Encoding"] = "gzip"
+        else:
+            response = HttpResponse(self.body, content_type="application/json")
+        response["ETag"] = etag
+        response["Cache-Control"] = "no-cache"
+        patch_vary_headers(response, ("Accept-Encoding",))
+        return response
+
+
+ingredient_index = IngredientIndex()
+ingredients_snapshot = DictionarySnapshot(
+    INGREDIENTS_VERSION, Ingredient.objects, ("id", "name", "measurement_unit")
+)
+tags_snapshot = DictionarySnapshot(
+    TAGS_VERSION, Tag.objects, ("id", "name", "slug")
+)
+known_ingredients = KnownIds(INGREDIENTS_VERSION, Ingredient.objects)
+known_tags = KnownIds(TAGS_VERSION, Tag.objects, "slug")
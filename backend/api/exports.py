@@ -0,0 +1,98 @@
+import csv
+import json
+from io import StringIO
+
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+
+class FormatNegotiation(DefaultContentNegotiation):
+    """
+    Выбирает рендерер только по параметру format, без учёта Accept.
+    Без параметра используется первый рендерер.
+    """
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        format_query = format_suffix or request.query_params.get(
+            self.settings.URL_FORMAT_OVERRIDE
+        )
+        if format_query:
+            renderers = self.filter_renderers(renderers, format_query)
+        return renderers[0], renderers[0].media_type
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Потоковая выгрузка списка покупок. render() нужен только для
+    ответов с ошибками, сам список формируется генератором stream().
+    """
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict) and "detail" in data:
+            data = data["detail"]
+        return str(data).encode(self.charset)
+
+    def stream(self, title, rows):
+        raise NotImplementedError
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = "text/plain"
+    format = "txt"
+
+    def stream(self, title, rows):
+        yield title.encode(self.charset)
+        for row in rows:
+            yield (
+                f'\n{row["name"]}: {row["amount"]} {row["measurement_unit"]}'
+            ).encode(self.charset)
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = "text/csv"
+    format = "csv"
+    fields = ("name", "amount", "measurement_unit")
+
+    def stream(self, title, rows):
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.fields)
+        for row in rows:
+            yield self.__flush(buffer)
+            writer.writerow([row[field] for field in self.fields])
+        yield self.__flush(buffer)
+
+    def __flush(self, buffer):
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk.encode(self.charset)
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    media_type = "application/json"
+    format = "json"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, title, rows):
+        yield (
+            f'{{"title": {json.dumps(title, ensure_ascii=False)}, '
+            f'"ingredients": ['
+        ).encode(self.charset)
+        separator = ""
+        for row in rows:
+            yield (
+                separator + json.dumps(row, ensure_ascii=False)
+            ).encode(self.charset)
+            separator = ", "
+        yield b"]}"
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    JSONShoppingListRenderer,
+)
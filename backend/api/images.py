@@ -0,0 +1,144 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models import F
+from PIL import Image
+
+from recipes.models import Recipe
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+VARIANT_WIDTHS = (320, 640)
+VARIANT_FORMATS = {"webp": "WEBP", "jpeg": "JPEG"}
+VARIANT_QUALITY = 80
+VARIANTS_DIR = "variants"
+
+__executor = None
+
+
+def get_variant_name(name, width, extension):
+    root, _ = os.path.splitext(name)
+    return f"{VARIANTS_DIR}/{root}_{width}w.{extension}"
+
+
+def get_variant_names(name):
+    return [
+        get_variant_name(name, width, extension)
+        for width in VARIANT_WIDTHS
+        for extension in VARIANT_FORMATS
+    ]
+
+
+def get_variant_urls(image, built_variants):
+    """
+    Возвращает {ширина: {формат: url}} уменьшенных копий изображения
+    или None, пока копии не построены. built_variants — имя изображения,
+    для которого сборка копий завершилась; хранилище не проверяется.
+    """
+    if not image or image.name != built_variants:
+        return None
+    storage = image.storage
+    return {
+        str(width): {
+            extension: storage.url(
+                get_variant_name(image.name, width, extension)
+            )
+            for extension in VARIANT_FORMATS
+        }
+        for width in VARIANT_WIDTHS
+    }
+
+
+def mark_variants_built(names):
+    """
+    Отмечает рецепты и аватары с изображениями names как имеющие копии.
+    Изображения хранятся по содержимому, поэтому одно имя может быть
+    у нескольких записей.
+    """
+    names = list(names)
+    if not names:
+        return
+    Recipe.objects.filter(image__in=names).update(built_variants=F("image"))
+    User.objects.filter(avatar__in=names).update(built_variants=F("avatar"))
+
+
+def build_variants(name, storage=default_storage, force=False):
+    """
+    Строит копии изображения всех ширин и форматов. Изображения уже
+    меньше нужной ширины только перекодируются. Возвращает число
+    записанных файлов.
+    """
+    names = get_variant_names(name)
+    if not force and all(storage.exists(variant) for variant in names):
+        return 0
+    with storage.open(name) as source, Image.open(source) as original:
+        if original.mode in ("RGB", "RGBA"):
+            image = original.copy()
+        else:
+            image = original.convert("RGBA")
+    written = 0
+    for width in VARIANT_WIDTHS:
+        resized = image.copy()
+        resized.thumbnail((width, resized.height))
+        for extension, image_format in VARIANT_FORMATS.items():
+            variant = resized
+            if image_format == "JPEG":
+                variant = resized.convert("RGB")
+            buffer = BytesIO()
+            variant.save(buffer, image_format, quality=VARIANT_QUALITY)
+            variant_name = get_variant_name(name, width, extension)
+            storage.delete(variant_name)
+            storage.save(variant_name, ContentFile(buffer.getvalue()))
+            written += 1
+    return written
+
+
+def schedule_variants(image, on_done=None):
+    """
+    После фиксации транзакции строит копии изображения в фоновом потоке
+    и вызывает on_done, чтобы сбросить закэшированные представления.
+    """
+    if not image:
+        return
+    name, storage = image.name, image.storage
+    transaction.on_commit(
+        lambda: __get_executor().submit(
+            __build_and_notify, name, storage, on_done
+        )
+    )
+
+
+def __get_executor():
+    global __executor
+    if __executor is None:
+        __executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_VARIANT_WORKERS,
+            thread_name_prefix="image-variants",
+        )
+    return __executor
+
+
+def __build_and_notify(name, storage, on_done):
+    # Потоки пула живут дольше запросов, а Django закрывает соединения
+    # только по сигналам запроса, поэтому соединение потока закрывается
+    # после каждой задачи.
+    try:
+        build_variants(name, storage)
+        mark_variants_built((name,))
+    except Exception:
+        logger.exception("Unable to build variants for %s", name)
+        return
+    else:
+        if on_done is not None:
+            on_done()
+    finally:
+        connection.close()
@@ -0,0 +1,151 @@
+import json
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max
+from rest_framework.parsers import BaseParser
+
+from recipes.models import Recipe, RecipeIngredient, RecipeTag
+from .cache import (PANTRY_VERSION, RECIPES_VERSION, bump_versions,
+                    invalidate_recipe)
+from .images import schedule_variants
+from .serializers import RecipeImportSerializer
+from .services import shift_counter
+from .utils import close_decoded_images
+
+User = get_user_model()
+
+IMPORT_CHUNK_SIZE = 500
+
+
+class NDJSONParser(BaseParser):
+    """
+    Разбирает тело запроса в формате NDJSON на строки. Сами строки
+    разбираются при импорте, чтобы ошибка в одной не отменяла остальные.
+    """
+    media_type = "application/x-ndjson"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return []
+        return [line.decode("utf-8", errors="replace") for line in stream]
+
+
+def import_recipes(lines, author, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Импортирует рецепты автора из строк NDJSON. Ссылки на тэги и
+    ингредиенты проверяются по кэшированным наборам id, корректные
+    рецепты вставляются пачками по chunk_size в отдельных транзакциях.
+    Возвращает отчёт с id созданных рецептов и ошибками по строкам.
+    """
+    report = {"created": [], "errors": []}
+    chunk = []
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            report["errors"].append(
+                {"line": number, "errors": ["Некорректный JSON"]}
+            )
+            continue
+        serializer = RecipeImportSerializer(data=data)
+        if not serializer.is_valid():
+            report["errors"].append(
+                {"line": number, "errors": serializer.errors}
+            )
+            continue
+        chunk.append((number, serializer.validated_data))
+        if len(chunk) >= chunk_size:
+            __insert_chunk(author, chunk, report)
+            chunk = []
+    if chunk:
+        __insert_chunk(author, chunk, report)
+    if report["created"]:
+        transaction.on_commit(
+            lambda: bump_versions(RECIPES_VERSION, PANTRY_VERSION)
+        )
+    return report
+
+
+def __insert_chunk(author, chunk, report):
+    try:
+        with transaction.atomic():
+            recipes = __create_recipes(author, chunk)
+    except DatabaseError as error:
+        report["errors"].extend(
+            {"line": number, "errors": [str(error)]} for number, _ in chunk
+        )
+        return
+    finally:
+        for _, data in chunk:
+            close_decoded_images(data)
+    report["created"].extend(
+        {"line": number, "id": recipe.pk}
+        for (number, _), recipe in zip(chunk, recipes)
+    )
+
+
+def __create_recipes(author, chunk):
+    recipes = Recipe.objects.bulk_create(
+        [
+            Recipe(
+                pk=pk,
+                author=author,
+                name=data["name"],
+                text=data["text"],
+                cooking_time=data["cooking_time"],
+                image=data.get("image"),
+            )
+            for pk, (_, data) in zip(__allocate_recipe_ids(len(chunk)), chunk)
+        ]
+    )
+    RecipeTag.objects.bulk_create(
+        [
+            RecipeTag(recipe=recipe, tag_id=tag_id)
+            for recipe, (_, data) in zip(recipes, chunk)
+            for tag_id in data["tags"]
+        ]
+    )
+    RecipeIngredient.objects.bulk_create(
+        [
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient_id=ingredient["id"],
+                amount=ingredient["amount"],
+            )
+            for recipe, (_, data) in zip(recipes, chunk)
+            for ingredient in data["ingredients"]
+        ]
+    )
+    Recipe.objects.filter(
+        pk__in=[recipe.pk for recipe in recipes]
+    ).update_search_vector()
+    for recipe in recipes:
+        if recipe.image:
+            schedule_variants(
+                recipe.image, partial(invalidate_recipe, recipe.pk)
+            )
+    shift_counter(User, author.pk, "recipes_count", len(recipes))
+    return recipes
+
+
+def __allocate_recipe_ids(count):
+    """
+    Резервирует id рецептов заранее: bulk_create возвращает ключи только
+    в PostgreSQL, а без них нельзя вставить тэги и ингредиенты. В других
+    базах id берутся после максимального; при параллельном импорте пачка
+    упадёт на первичном ключе и попадёт в отчёт ошибками.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                "FROM generate_series(1, %s)",
+                (Recipe._meta.db_table, count),
+            )
+            return [pk for pk, in cursor.fetchall()]
+    start = (Recipe.objects.aggregate(pk=Max("pk"))["pk"] or 0) + 1
+    return list(range(start, start + count))
@@ -0,0 +1,172 @@
+from collections import Counter
+from heapq import nlargest
+
+from django.core.cache import cache
+from django.db import connection
+
+from recipes.models import RecipeIngredient
+from .cache import (PANTRY_CHANGE, PANTRY_VERSION, bump_version,
+                    get_versions)
+from .dictionaries import LocalDictionary
+
+# Изменения рецептов хранятся в общем кэше, пока их не применят остальные
+# процессы. Отставший дальше этого или потерявший запись процесс
+# перестраивает индекс целиком.
+PANTRY_CHANGE_TIMEOUT = 60 * 60
+PANTRY_MAX_REPLAY = 1000
+# Номера изменений выдаёт последовательность PostgreSQL: incr файлового
+# кэша не атомарен, и два процесса могли получить один номер. В других
+# базах изменение сменяет версию индекса, и остальные процессы
+# перестраивают его целиком.
+PANTRY_SEQUENCE = "pantry_change_seq"
+
+
+class PantryIndex(LocalDictionary):
+    """
+    Обратный индекс ингредиент -> рецепты для подбора рецептов по
+    имеющимся продуктам. Изменения рецептов применяются инкрементально:
+    в текущем процессе сразу, в остальных — из журнала изменений в общем
+    кэше. Смена версии перестраивает индекс целиком.
+    """
+    version_key = PANTRY_VERSION
+
+    def __init__(self):
+        super().__init__()
+        self.sequence = None
+
+    def refresh(self):
+        version, = get_versions(self.version_key)
+        sequence = self.__last_sequence()
+        if version == self.version and sequence == self.sequence:
+            return self
+        with self.lock:
+            if version != self.version or not self.__replay(sequence):
+                self.build()
+                self.version, self.sequence = version, sequence
+        return self
+
+    def build(self):
+        postings = {}
+        recipes = {}
+        rows = RecipeIngredient.objects.values_list(
+            "recipe_id", "ingredient_id"
+        )
+        for recipe_id, ingredient_id in rows.iterator():
+            postings.setdefault(ingredient_id, set()).add(recipe_id)
+            recipes.setdefault(recipe_id, set()).add(ingredient_id)
+        self.postings = postings
+        self.recipes = {
+            recipe_id: frozenset(ingredient_ids)
+            for recipe_id, ingredient_ids in recipes.items()
+        }
+
+    def match(self, ingredient_ids, limit):
+        """
+        Возвращает до limit кортежей (id рецепта, найдено, всего),
+        упорядоченных по доле имеющихся ингредиентов рецепта.
+        """
+        self.refresh()
+        matched = Counter()
+        with self.lock:
+            postings, recipes = self.postings, self.recipes
+            for ingredient_id in set(ingredient_ids):
+                matched.update(postings.get(ingredient_id, ()))
+            totals = {
+                recipe_id: len(recipes[recipe_id]) for recipe_id in matched
+            }
+        top = nlargest(
+            limit,
+            matched.items(),
+            key=lambda item: (
+                item[1] / totals[item[0]], item[1], item[0]
+            ),
+        )
+        return [
+            (recipe_id, count, totals[recipe_id])
+            for recipe_id, count in top
+        ]
+
+    def set_recipe(self, recipe_id, ingredient_ids):
+        """
+        Заменяет ингредиенты рецепта в индексе и записывает изменение в
+        журнал для остальных процессов. Пустой набор удаляет рецепт.
+        Вызывается после фиксации транзакции.
+        """
+        ingredient_ids = frozenset(int(pk) for pk in ingredient_ids)
+        self.refresh()
+        with self.lock:
+            self.__apply(recipe_id, ingredient_ids)
+            if connection.vendor != "postgresql":
+                bump_version(PANTRY_VERSION)
+                return
+            sequence = self.__next_sequence()
+            cache.set(
+                PANTRY_CHANGE.format(sequence),
+                (recipe_id, tuple(ingredient_ids)),
+                timeout=PANTRY_CHANGE_TIMEOUT,
+            )
+            if sequence == self.sequence + 1:
+                self.sequence = sequence
+
+    def reload_recipe(self, recipe_id):
+        """
+        Перечитывает ингредиенты рецепта из базы после изменений в обход
+        сериализатора (админка, каскадное удаление).
+        """
+        self.set_recipe(
+            recipe_id,
+            RecipeIngredient.objects.filter(recipe_id=recipe_id)
+            .values_list("ingredient_id", flat=True),
+        )
+
+    def __replay(self, sequence):
+        """
+        Применяет изменения других процессов после self.sequence.
+        Возвращает False, если журнал неполон и нужна перестройка.
+        """
+        if not 0 <= sequence - self.sequence <= PANTRY_MAX_REPLAY:
+            return False
+        keys = [
+            PANTRY_CHANGE.format(number)
+            for number in range(self.sequence + 1, sequence + 1)
+        ]
+        changes = cache.get_many(keys)
+        if len(changes) != len(keys):
+            return False
+        for key in keys:
+            recipe_id, ingredient_ids = changes[key]
+            self.__apply(recipe_id, frozenset(ingredient_ids))
+        self.sequence = sequence
+        return True
+
+    def __last_sequence(self):
+        if connection.vendor != "postgresql":
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT CASE WHEN is_called THEN last_value ELSE 0 END "
+                f"FROM {PANTRY_SEQUENCE}"
+            )
+            return cursor.fetchone()[0]
+
+    def __next_sequence(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval(%s)", (PANTRY_SEQUENCE,))
+            return cursor.fetchone()[0]
+
+    def __apply(self, recipe_id, ingredient_ids):
+        previous = self.recipes.get(recipe_id, frozenset())
+        for ingredient_id in previous - ingredient_ids:
+            posting = self.postings[ingredient_id]
+            posting.discard(recipe_id)
+            if not posting:
+                del self.postings[ingredient_id]
+        for ingredient_id in ingredient_ids - previous:
+            self.postings.setdefault(ingredient_id, set()).add(recipe_id)
+        if ingredient_ids:
+            self.recipes[recipe_id] = ingredient_ids
+        else:
+            self.recipes.pop(recipe_id, None)
+
+
+pantry_index = PantryIndex()
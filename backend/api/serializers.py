@@ -1,26 +1,80 @@
+import json
+from functools import partial
+
 from django.db import transaction
 from django.contrib.auth import get_user_model
+from django.http import QueryDict
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
-from .utils import Base64ImageField
+from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeTag,
+                            Tag)
+from .cache import invalidate_recipe
+from .dictionaries import known_ingredients, known_tags
+from .images import get_variant_urls, schedule_variants
+from .pantry import pantry_index
+from .services import (SYNC_ADD, SYNC_RELATIONS, SYNC_REMOVE,
+                       get_cart_user_ids, invalidate_author,
+                       shift_shopping_lists)
+from .utils import Base64ImageField, close_decoded_images
 
 User = get_user_model()
 
+SYNC_MAX_OPERATIONS = 500
+
+
+def check_tag_ids(tag_ids):
+    """
+    Общая проверка тэгов рецепта: без повторов и только существующие.
+    """
+    if len(set(tag_ids)) != len(tag_ids):
+        raise ValidationError('Тэги повторяются')
+    if not known_tags.contains(tag_ids):
+        raise ValidationError('Один или несколько тэгов не существуют')
+
+
+def check_ingredient_ids(ingredient_ids):
+    """
+    Общая проверка ингредиентов рецепта: без повторов и только
+    существующие.
+    """
+    if len(set(ingredient_ids)) != len(ingredient_ids):
+        raise ValidationError('Ингредиенты повторяются')
+    if not known_ingredients.contains(ingredient_ids):
+        raise ValidationError(
+            'Один или несколько ингредиентов не существуют'
+        )
+
 
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.BooleanField(read_only=True, default=False)
     avatar = serializers.SerializerMethodField(read_only=True)
+    avatar_variants = serializers.SerializerMethodField(read_only=True)
 
     def get_avatar(self, obj):
         return obj.avatar.url if obj.avatar else None
 
+    def get_avatar_variants(self, obj):
+        return get_variant_urls(obj.avatar, obj.built_variants)
+
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'avatar': self.get_avatar(instance),
+            'avatar_variants': self.get_avatar_variants(instance),
+            'is_subscribed': bool(getattr(instance, 'is_subscribed', False)),
+            'username': instance.username,
+            'first_name': instance.first_name,
+            'last_name': instance.last_name,
+            'email': instance.email,
+        }
+
     class Meta:
         model = User
         fields = (
             'id',
             'avatar',
+            'avatar_variants',
             'is_subscribed',
             'username',
             'first_name',
@@ -32,6 +86,19 @@ class UserSerializer(serializers.ModelSerializer):
 class UserSetAvatarSerializer(serializers.ModelSerializer):
     avatar = Base64ImageField()
 
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            close_decoded_images(self.validated_data)
+
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        schedule_variants(
+            instance.avatar, partial(invalidate_author, instance.pk)
+        )
+        return instance
+
     def to_representation(self, data):
         return {'avatar': data.avatar.url}
 
@@ -42,13 +109,26 @@ class UserSetAvatarSerializer(serializers.ModelSerializer):
 
 class RecipeMinifiedSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField(read_only=True)
+    image_variants = serializers.SerializerMethodField(read_only=True)
 
     def get_image(self, obj):
         return obj.image.url if obj.image else None
 
+    def get_image_variants(self, obj):
+        return get_variant_urls(obj.image, obj.built_variants)
+
+    def to_representation(self, instance):
+        return {
+            'id': instance.id,
+            'name': instance.name,
+            'image': self.get_image(instance),
+            'image_variants': self.get_image_variants(instance),
+            'cooking_time': instance.cooking_time,
+        }
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class UserWithRecipesSerializer(UserSerializer):
@@ -56,13 +136,16 @@ class UserWithRecipesSerializer(UserSerializer):
     recipes_count = serializers.IntegerField()
 
     def get_recipes(self, obj):
-        query = obj.recipes.all()
-        recipes_limit = self.context['request'].GET.get('recipes_limit')
-        if recipes_limit:
-            query = query[: int(recipes_limit)]
-        serializer = RecipeMinifiedSerializer(query, many=True)
+        # Рецепты авторам заранее проставляет set_latest_recipes.
+        serializer = RecipeMinifiedSerializer(obj.latest_recipes, many=True)
         return serializer.data
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['recipes'] = self.get_recipes(instance)
+        data['recipes_count'] = instance.recipes_count
+        return data
+
     class Meta(UserSerializer.Meta):
         fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
 
@@ -101,14 +184,43 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_in_shopping_cart = serializers.BooleanField(
         read_only=True, default=False)
     image = Base64ImageField()
+    image_variants = serializers.SerializerMethodField(read_only=True)
     name = serializers.CharField(max_length=256)
     text = serializers.CharField()
     cooking_time = serializers.IntegerField(min_value=1)
 
     def to_representation(self, instance):
-        data = super().to_representation(instance)
-        data['image'] = instance.image.url if instance.image else None
-        return data
+        return {
+            'id': instance.id,
+            'tags': [
+                {'id': tag.id, 'name': tag.name, 'slug': tag.slug}
+                for tag in instance.tags.all()
+            ],
+            'name': instance.name,
+            'text': instance.text,
+            'ingredients': [
+                {
+                    'id': recipe_ingredient.ingredient.id,
+                    'name': recipe_ingredient.ingredient.name,
+                    'measurement_unit': (
+                        recipe_ingredient.ingredient.measurement_unit
+                    ),
+                    'amount': recipe_ingredient.amount,
+                }
+                for recipe_ingredient in instance.recipeingredient_set.all()
+            ],
+            'image': instance.image.url if instance.image else None,
+            'image_variants': self.get_image_variants(instance),
+            'cooking_time': instance.cooking_time,
+            'author': UserSerializer().to_representation(instance.author),
+            'is_favorited': bool(getattr(instance, 'is_favorited', False)),
+            'is_in_shopping_cart': bool(
+                getattr(instance, 'is_in_shopping_cart', False)
+            ),
+        }
+
+    def get_image_variants(self, obj):
+        return get_variant_urls(obj.image, obj.built_variants)
 
     def get_fields(self, *args, **kwargs):
         fields = super().get_fields()
@@ -117,10 +229,18 @@ class RecipeSerializer(serializers.ModelSerializer):
         return fields
 
     def validate(self, attrs):
-        self.__validate_tags(attrs)
-        self.__validate_ingredients(attrs)
+        if not self.partial or 'tags' in self.initial_data:
+            self.__validate_tags(attrs)
+        if not self.partial or 'ingredients' in self.initial_data:
+            self.__validate_ingredients(attrs)
         return attrs
 
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            close_decoded_images(self.validated_data)
+
     @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
@@ -128,22 +248,95 @@ class RecipeSerializer(serializers.ModelSerializer):
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
         self.__set_ingredients(recipe, ingredients)
+        self.__schedule_variants(recipe)
         return recipe
 
     @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
         for key, val in validated_data.items():
             setattr(instance, key, val)
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.__set_ingredients(instance, ingredients)
+        if tags is not None:
+            self.__update_tags(instance, tags)
+        if ingredients is not None:
+            self.__update_ingredients(instance, ingredients)
         instance.save()
+        if 'image' in validated_data:
+            self.__schedule_variants(instance)
         return instance
 
+    def __schedule_variants(self, recipe):
+        schedule_variants(recipe.image, partial(invalidate_recipe, recipe.pk))
+
+    def __update_tags(self, recipe, tags):
+        current = set(
+            RecipeTag.objects
+            .filter(recipe=recipe)
+            .values_list('tag_id', flat=True)
+        )
+        tags = {int(tag) for tag in tags}
+        if current - tags:
+            RecipeTag.objects.filter(
+                recipe=recipe, tag_id__in=current - tags
+            ).delete()
+        RecipeTag.objects.bulk_create(
+            [RecipeTag(recipe=recipe, tag_id=tag) for tag in tags - current]
+        )
+
+    def __update_ingredients(self, recipe, ingredients):
+        current = {
+            item.ingredient_id: item
+            for item in RecipeIngredient.objects.filter(recipe=recipe)
+        }
+        old_amounts = {pk: item.amount for pk, item in current.items()}
+        new_amounts = {
+            int(ingredient['id']): int(ingredient['amount'])
+            for ingredient in ingredients
+        }
+        removed = old_amounts.keys() - new_amounts.keys()
+        added = new_amounts.keys() - old_amounts.keys()
+        changed = [
+            item
+            for pk, item in current.items()
+            if pk in new_amounts and item.amount != new_amounts[pk]
+        ]
+        for item in changed:
+            item.amount = new_amounts[item.ingredient_id]
+        if removed:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed
+            ).delete()
+        RecipeIngredient.objects.bulk_create(
+            [
+                RecipeIngredient(
+                    recipe=recipe, ingredient_id=pk, amount=new_amounts[pk]
+                )
+                for pk in added
+            ]
+        )
+        RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        if removed or added:
+            ingredient_ids = list(new_amounts)
+            transaction.on_commit(
+                lambda: pantry_index.set_recipe(recipe.id, ingredient_ids)
+            )
+        if added or changed:
+            # Убранные ингредиенты вычитают из списков покупок сигналы
+            # post_delete, пакетные вставка и обновление их не вызывают.
+            shift_shopping_lists(
+                get_cart_user_ids(recipe.pk),
+                {
+                    pk: new_amounts[pk] - old_amounts.get(pk, 0)
+                    for pk in new_amounts
+                },
+            )
+
     def __set_ingredients(self, recipe, ingredients):
+        ingredient_ids = [int(ingredient['id']) for ingredient in ingredients]
+        transaction.on_commit(
+            lambda: pantry_index.set_recipe(recipe.id, ingredient_ids)
+        )
         RecipeIngredient.objects.bulk_create(
             objs=[
                 RecipeIngredient(
@@ -155,18 +348,30 @@ class RecipeSerializer(serializers.ModelSerializer):
             ]
         )
 
+    def __get_list(self, name):
+        """
+        Список из данных запроса. В multipart-форме список передаётся
+        повторяющимся полем или строкой JSON.
+        """
+        if not isinstance(self.initial_data, QueryDict):
+            return self.initial_data.get(name)
+        values = self.initial_data.getlist(name)
+        if len(values) == 1 and values[0].startswith('['):
+            try:
+                return json.loads(values[0])
+            except ValueError:
+                raise ValidationError(f'Некорректный формат поля {name}')
+        return values
+
     def __validate_tags(self, attrs):
-        tags = self.initial_data.get('tags')
+        tags = self.__get_list('tags')
         if not tags:
             raise ValidationError('Отсутствует поле тэгов')
-        if len(set(tags)) != len(tags):
-            raise ValidationError('Тэги повторяются')
-        if len(Tag.objects.filter(id__in=tags)) != len(tags):
-            raise ValidationError('Один или несколько тэгов не существуют')
+        check_tag_ids(tags)
         attrs['tags'] = tags
 
     def __validate_ingredients(self, attrs):
-        ingredients = self.initial_data.get('ingredients')
+        ingredients = self.__get_list('ingredients')
         if not ingredients:
             raise ValidationError('Отсутствует поле ингредиентов')
         invalid_data = filter(
@@ -177,9 +382,6 @@ class RecipeSerializer(serializers.ModelSerializer):
         )
         if list(invalid_data):
             raise ValidationError('Некорректный формат данных об ингредиентах')
-        ingredient_ids = [ingredient['id'] for ingredient in ingredients]
-        if len(set(ingredient_ids)) != len(ingredient_ids):
-            raise ValidationError('Ингредиенты повторяются')
         invalid_data = filter(
             lambda ingredient: ingredient.get('amount') < 1, ingredients
         )
@@ -187,15 +389,9 @@ class RecipeSerializer(serializers.ModelSerializer):
             raise ValidationError(
                 'Количество ингредиентов должно быть больше 1'
             )
-        existing_ingredients = (
-            Ingredient.objects
-            .filter(id__in=ingredient_ids)
-            .count()
+        check_ingredient_ids(
+            [ingredient['id'] for ingredient in ingredients]
         )
-        if existing_ingredients != len(ingredient_ids):
-            raise ValidationError(
-                'Один или несколько ингредиентов не существуют'
-            )
         attrs['ingredients'] = ingredients
 
     class Meta:
@@ -207,8 +403,55 @@ class RecipeSerializer(serializers.ModelSerializer):
             'text',
             'ingredients',
             'image',
+            'image_variants',
             'cooking_time',
             'author',
             'is_favorited',
             'is_in_shopping_cart',
         )
+
+
+class SyncOperationSerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=tuple(SYNC_RELATIONS))
+    action = serializers.ChoiceField(choices=(SYNC_ADD, SYNC_REMOVE))
+    id = serializers.IntegerField(min_value=1)
+
+
+class SyncSerializer(serializers.Serializer):
+    operations = serializers.ListField(
+        child=SyncOperationSerializer(),
+        allow_empty=False,
+        max_length=SYNC_MAX_OPERATIONS,
+    )
+
+
+class RecipeImportIngredientSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    amount = serializers.IntegerField(min_value=1)
+
+
+class RecipeImportSerializer(serializers.Serializer):
+    """
+    Строка массового импорта. Тэги и ингредиенты проверяются по
+    кэшированным наборам id без запросов к базе.
+    """
+    name = serializers.CharField(max_length=256)
+    text = serializers.CharField()
+    cooking_time = serializers.IntegerField(min_value=1)
+    image = Base64ImageField(required=False)
+    tags = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False
+    )
+    ingredients = serializers.ListField(
+        child=RecipeImportIngredientSerializer(), allow_empty=False
+    )
+
+    def validate_tags(self, tags):
+        check_tag_ids(tags)
+        return tags
+
+    def validate_ingredients(self, ingredients):
+        check_ingredient_ids(
+            [ingredient['id'] for ingredient in ingredients]
+        )
+        return ingredients
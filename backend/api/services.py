@@ -1,21 +1,628 @@
-from django.db.models import F, Sum
+from hashlib import sha1
 
-from recipes.models import RecipeIngredient
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import CharField, F, Sum, Value
+from django.db.models.functions import Greatest
 
+from recipes.models import (Recipe, RecipeIngredient, ShoppingListItem,
+                            Subscription, UserFavoriteRecipes,
+                            UserShoppingCart)
+from .cache import invalidate_author_recipes
 
-def get_shopping_list(user):
-    ings = (
-        RecipeIngredient.objects.filter(recipe__shopping_cart=user)
+User = get_user_model()
+
+
+def shift_counter(model_cls, pk, field, delta):
+    """
+    Сдвигает счётчик на delta. Уменьшение не опускает его ниже нуля: связь
+    могла появиться в обход счётчиков, а поле неотрицательное.
+    """
+    value = F(field) + delta
+    if delta < 0:
+        value = Greatest(value, 0)
+    model_cls.objects.filter(pk=pk).update(**{field: value})
+
+
+def invalidate_author(author_id):
+    """
+    Сбрасывает закэшированные представления рецептов автора, в которые
+    входит его профиль.
+    """
+    invalidate_author_recipes(
+        Recipe.objects.filter(author_id=author_id).values_list("id", flat=True)
+    )
+
+
+FAVORITED = "favorited"
+IN_SHOPPING_CART = "in_shopping_cart"
+SUBSCRIBED = "subscribed"
+
+
+def get_user_flags(user, recipe_ids, author_ids):
+    """
+    Возвращает множество пар (флаг, id) для избранного, списка покупок и
+    подписок пользователя одним запросом. Для анонимов запрос не выполняется.
+    """
+    if not user.is_authenticated or not (recipe_ids or author_ids):
+        return set()
+    return set(
+        __flag_query(UserFavoriteRecipes, FAVORITED, "recipe_id")
+        .filter(user=user, recipe_id__in=recipe_ids)
+        .union(
+            __flag_query(UserShoppingCart, IN_SHOPPING_CART, "recipe_id")
+            .filter(user=user, recipe_id__in=recipe_ids),
+            __flag_query(Subscription, SUBSCRIBED, "following_id")
+            .filter(user=user, following_id__in=author_ids),
+            all=True,
+        )
+    )
+
+
+def set_user_flags(recipes, user):
+    flags = get_user_flags(
+        user,
+        [recipe.id for recipe in recipes],
+        {recipe.author_id for recipe in recipes},
+    )
+    for recipe in recipes:
+        recipe.is_favorited = (FAVORITED, recipe.id) in flags
+        recipe.is_in_shopping_cart = (IN_SHOPPING_CART, recipe.id) in flags
+        recipe.author.is_subscribed = (SUBSCRIBED, recipe.author_id) in flags
+    return recipes
+
+
+def apply_user_flags(recipes_data, user):
+    """
+    Накладывает пользовательские флаги на общие представления рецептов.
+    """
+    flags = get_user_flags(
+        user,
+        [data["id"] for data in recipes_data],
+        {data["author"]["id"] for data in recipes_data},
+    )
+    return [
+        {
+            **data,
+            "author": {
+                **data["author"],
+                "is_subscribed": (
+                    (SUBSCRIBED, data["author"]["id"]) in flags
+                ),
+            },
+            "is_favorited": (FAVORITED, data["id"]) in flags,
+            "is_in_shopping_cart": (IN_SHOPPING_CART, data["id"]) in flags,
+        }
+        for data in recipes_data
+    ]
+
+
+def __flag_query(model_cls, flag, id_field):
+    return model_cls.objects.annotate(
+        flag=Value(flag, output_field=CharField())
+    ).values_list("flag", id_field)
+
+
+def set_latest_recipes(authors, limit=None):
+    """
+    Проставляет авторам latest_recipes: до limit последних рецептов
+    каждого, выбранных одним запросом.
+    """
+    recipes = {author.pk: [] for author in authors}
+    if not recipes:
+        # Пустой filter(author_id__in=[]) не строит SQL для оконного
+        # запроса и падает с EmptyResultSet.
+        return authors
+    for recipe in Recipe.detailed.latest_by_authors(list(recipes), limit):
+        recipes[recipe.author_id].append(recipe)
+    for author in authors:
+        author.latest_recipes = recipes[author.pk]
+    return authors
+
+
+def get_cart_user_ids(recipe_id):
+    return list(
+        UserShoppingCart.objects
+        .filter(recipe_id=recipe_id)
+        .values_list("user_id", flat=True)
+    )
+
+
+@transaction.atomic
+def shift_shopping_lists(user_ids, deltas):
+    """
+    Прибавляет к спискам покупок пользователей изменения количества
+    {id ингредиента: дельта}. Позиции с нулевым остатком удаляются.
+    Вызывается в транзакции изменения корзины или рецепта; при вызове
+    вне транзакции открывает свою для select_for_update.
+    """
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items()
+        if delta
+    }
+    if not user_ids or not deltas:
+        return
+    items = {
+        (item.user_id, item.ingredient_id): item
+        for item in ShoppingListItem.objects.select_for_update().filter(
+            user_id__in=user_ids, ingredient_id__in=deltas
+        )
+    }
+    to_create, to_update, to_delete = [], [], []
+    for user_id in user_ids:
+        for ingredient_id, delta in deltas.items():
+            item = items.get((user_id, ingredient_id))
+            if item is None:
+                if delta > 0:
+                    to_create.append(
+                        ShoppingListItem(
+                            user_id=user_id,
+                            ingredient_id=ingredient_id,
+                            amount=delta,
+                        )
+                    )
+                continue
+            item.amount += delta
+            if item.amount > 0:
+                to_update.append(item)
+            else:
+                to_delete.append(item.pk)
+    ShoppingListItem.objects.bulk_create(to_create)
+    ShoppingListItem.objects.bulk_update(to_update, ("amount",))
+    ShoppingListItem.objects.filter(pk__in=to_delete).delete()
+
+
+def get_cart_amounts(user_ids=None, ingredient_ids=None):
+    """
+    Суммы ингредиентов корзин {(id пользователя, id ингредиента): сумма},
+    посчитанные по рецептам в корзинах. По ним сверяются и пересчитываются
+    списки покупок.
+    """
+    # Условия на корзину задаются одним filter(): каждый следующий вызов
+    # по многозначной связи добавил бы ещё одно соединение с корзинами.
+    conditions = {"recipe__usershoppingcart__isnull": False}
+    if user_ids is not None:
+        conditions["recipe__usershoppingcart__user_id__in"] = user_ids
+    if ingredient_ids is not None:
+        conditions["ingredient_id__in"] = ingredient_ids
+    rows = (
+        RecipeIngredient.objects.filter(**conditions)
+        .values_list("recipe__usershoppingcart__user_id", "ingredient_id")
+        .annotate(total=Sum("amount"))
+        .order_by()
+    )
+    return {
+        (user_id, ingredient_id): total
+        for user_id, ingredient_id, total in rows.iterator()
+    }
+
+
+@transaction.atomic
+def rebuild_shopping_lists(user_ids, ingredient_ids=None):
+    """
+    Приводит списки покупок пользователей к суммам их корзин, при
+    ingredient_ids — только по этим ингредиентам. В отличие от
+    shift_shopping_lists не зависит от прежнего состояния списка, поэтому
+    повторный вызов ничего не меняет.
+    """
+    user_ids = list(user_ids)
+    if not user_ids or ingredient_ids is not None and not ingredient_ids:
+        return
+    expected = get_cart_amounts(user_ids, ingredient_ids)
+    items = ShoppingListItem.objects.select_for_update().filter(
+        user_id__in=user_ids
+    )
+    if ingredient_ids is not None:
+        items = items.filter(ingredient_id__in=ingredient_ids)
+    to_update, to_delete = [], []
+    for item in items:
+        amount = expected.pop((item.user_id, item.ingredient_id), None)
+        if amount is None:
+            to_delete.append(item.pk)
+        elif amount != item.amount:
+            item.amount = amount
+            to_update.append(item)
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=user_id, ingredient_id=ingredient_id, amount=amount
+        )
+        for (user_id, ingredient_id), amount in expected.items()
+    )
+    ShoppingListItem.objects.bulk_update(to_update, ("amount",))
+    ShoppingListItem.objects.filter(pk__in=to_delete).delete()
+
+
+def __tables():
+    return {
+        "recipe": Recipe._meta.db_table,
+        "user": User._meta.db_table,
+        "amounts": RecipeIngredient._meta.db_table,
+        "items": ShoppingListItem._meta.db_table,
+        "subscription": Subscription._meta.db_table,
+    }
+
+
+# Добавление и удаление рецепта из избранного или корзины, подписка и
+# отписка на PostgreSQL выполняются одним запросом вместе со счётчиками
+# и списком покупок. Для других СУБД используется ORM в транзакции, а
+# счётчики и списки покупок поддерживают обработчики сигналов моделей.
+ADD_RELATION_SQL = """
+    WITH target AS (
+        SELECT {recipe_fields} FROM {recipe} WHERE id = %(recipe)s
+    ), changed AS (
+        INSERT INTO {relation} (user_id, recipe_id)
+        SELECT %(user)s, id FROM target
+        ON CONFLICT (user_id, recipe_id) DO NOTHING
+        RETURNING recipe_id
+    ), counter AS (
+        UPDATE {recipe} SET {counter} = {counter} + 1
+        WHERE id IN (SELECT recipe_id FROM changed)
+    ){shopping_list}
+    SELECT {recipe_fields}, EXISTS (SELECT 1 FROM changed) FROM target
+"""
+ADD_SHOPPING_LIST_SQL = """, items AS (
+        INSERT INTO {items} (user_id, ingredient_id, amount)
+        SELECT %(user)s, ingredient_id, SUM(amount) FROM {amounts}
+        WHERE recipe_id IN (SELECT recipe_id FROM changed)
+        GROUP BY ingredient_id
+        ON CONFLICT (user_id, ingredient_id)
+        DO UPDATE SET amount = {items}.amount + EXCLUDED.amount
+    )"""
+# Пакетное добавление связей при синхронизации. Счётчики и списки покупок
+# сдвигаются только для вставленных строк: часть связей мог уже добавить
+# параллельный запрос.
+ADD_RELATIONS_SQL = """
+    WITH changed AS (
+        INSERT INTO {relation} (user_id, {field})
+        SELECT %(user)s, pk FROM unnest(%(ids)s) AS pk
+        ON CONFLICT (user_id, {field}) DO NOTHING
+        RETURNING {field}
+    ), counter AS (
+        UPDATE {target} SET {counter} = {counter} + 1
+        WHERE id IN (SELECT {field} FROM changed)
+    ){shopping_list}
+    SELECT count(*) FROM changed
+"""
+REMOVE_RELATION_SQL = """
+    WITH target AS (
+        SELECT id FROM {recipe} WHERE id = %(recipe)s
+    ), changed AS (
+        DELETE FROM {relation}
+        WHERE user_id = %(user)s AND recipe_id IN (SELECT id FROM target)
+        RETURNING recipe_id
+    ), counter AS (
+        UPDATE {recipe} SET {counter} = GREATEST({counter} - 1, 0)
+        WHERE id IN (SELECT recipe_id FROM changed)
+    ){shopping_list}
+    SELECT EXISTS (SELECT 1 FROM target), EXISTS (SELECT 1 FROM changed)
+"""
+REMOVE_SHOPPING_LIST_SQL = """, decreased AS (
+        UPDATE {items} SET amount = {items}.amount - a.amount
+        FROM {amounts} a
+        WHERE a.recipe_id IN (SELECT recipe_id FROM changed)
+          AND {items}.user_id = %(user)s
+          AND {items}.ingredient_id = a.ingredient_id
+          AND {items}.amount > a.amount
+    ), emptied AS (
+        DELETE FROM {items} USING {amounts} a
+        WHERE a.recipe_id IN (SELECT recipe_id FROM changed)
+          AND {items}.user_id = %(user)s
+          AND {items}.ingredient_id = a.ingredient_id
+          AND {items}.amount <= a.amount
+    )"""
+SUBSCRIBE_SQL = """
+    WITH target AS (
+        SELECT {user_fields} FROM {user} WHERE id = %(following)s
+    ), changed AS (
+        INSERT INTO {subscription} (user_id, following_id)
+        SELECT %(user)s, id FROM target
+        ON CONFLICT (user_id, following_id) DO NOTHING
+        RETURNING following_id
+    ), counter AS (
+        UPDATE {user} SET followers_count = followers_count + 1
+        WHERE id IN (SELECT following_id FROM changed)
+    )
+    SELECT {user_fields}, EXISTS (SELECT 1 FROM changed) FROM target
+"""
+UNSUBSCRIBE_SQL = """
+    WITH target AS (
+        SELECT id FROM {user} WHERE id = %(following)s
+    ), changed AS (
+        DELETE FROM {subscription}
+        WHERE user_id = %(user)s AND following_id IN (SELECT id FROM target)
+        RETURNING following_id
+    ), counter AS (
+        UPDATE {user} SET followers_count = GREATEST(followers_count - 1, 0)
+        WHERE id IN (SELECT following_id FROM changed)
+    )
+    SELECT EXISTS (SELECT 1 FROM target), EXISTS (SELECT 1 FROM changed)
+"""
+RECIPE_FIELDS = ("id", "name", "image", "cooking_time", "built_variants")
+USER_FIELDS = (
+    "id",
+    "username",
+    "first_name",
+    "last_name",
+    "email",
+    "avatar",
+    "recipes_count",
+    "followers_count",
+    "built_variants",
+)
+
+
+def add_recipe_relation(model_cls, counter, user, recipe_id):
+    """
+    Добавляет рецепт в избранное или корзину пользователя.
+    Возвращает (рецепт или None, если его нет; создана ли связь).
+    """
+    if connection.vendor != "postgresql":
+        return __add_recipe_relation_orm(model_cls, counter, user, recipe_id)
+    shopping_list = (
+        ADD_SHOPPING_LIST_SQL if model_cls is UserShoppingCart else ""
+    )
+    row = __fetch_one(
+        ADD_RELATION_SQL.replace("{shopping_list}", shopping_list),
+        {"user": user.pk, "recipe": recipe_id},
+        relation=model_cls._meta.db_table,
+        counter=counter,
+        recipe_fields=", ".join(RECIPE_FIELDS),
+    )
+    if row is None:
+        return None, False
+    *fields, created = row
+    return Recipe(**dict(zip(RECIPE_FIELDS, fields))), created
+
+
+def remove_recipe_relation(model_cls, counter, user, recipe_id):
+    """
+    Убирает рецепт из избранного или корзины пользователя.
+    Возвращает (существует ли рецепт, была ли удалена связь).
+    """
+    if connection.vendor != "postgresql":
+        return __remove_recipe_relation_orm(
+            model_cls, counter, user, recipe_id
+        )
+    shopping_list = (
+        REMOVE_SHOPPING_LIST_SQL if model_cls is UserShoppingCart else ""
+    )
+    return __fetch_one(
+        REMOVE_RELATION_SQL.replace("{shopping_list}", shopping_list),
+        {"user": user.pk, "recipe": recipe_id},
+        relation=model_cls._meta.db_table,
+        counter=counter,
+    )
+
+
+def add_subscription(user, following_id):
+    """
+    Подписывает пользователя на автора.
+    Возвращает (автор или None, если его нет; создана ли подписка).
+    """
+    if connection.vendor != "postgresql":
+        return __add_subscription_orm(user, following_id)
+    row = __fetch_one(
+        SUBSCRIBE_SQL,
+        {"user": user.pk, "following": following_id},
+        user_fields=", ".join(USER_FIELDS),
+    )
+    if row is None:
+        return None, False
+    *fields, created = row
+    following = User(**dict(zip(USER_FIELDS, fields)))
+    following.is_subscribed = True
+    if created:
+        following.followers_count += 1
+    return following, created
+
+
+def remove_subscription(user, following_id):
+    """
+    Отписывает пользователя от автора.
+    Возвращает (существует ли автор, была ли удалена подписка).
+    """
+    if connection.vendor != "postgresql":
+        return __remove_subscription_orm(user, following_id)
+    return __fetch_one(
+        UNSUBSCRIBE_SQL, {"user": user.pk, "following": following_id}
+    )
+
+
+def __fetch_one(sql, params, **names):
+    with connection.cursor() as cursor:
+        cursor.execute(sql.format(**__tables(), **names), params)
+        return cursor.fetchone()
+
+
+@transaction.atomic
+def __add_recipe_relation_orm(model_cls, counter, user, recipe_id):
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is None:
+        return None, False
+    _, created = model_cls.objects.get_or_create(user=user, recipe=recipe)
+    return recipe, created
+
+
+@transaction.atomic
+def __remove_recipe_relation_orm(model_cls, counter, user, recipe_id):
+    if not Recipe.objects.filter(pk=recipe_id).exists():
+        return False, False
+    deleted, _ = model_cls.objects.filter(
+        user=user, recipe_id=recipe_id
+    ).delete()
+    return True, bool(deleted)
+
+
+@transaction.atomic
+def __add_subscription_orm(user, following_id):
+    following = User.objects.filter(pk=following_id).first()
+    if following is None:
+        return None, False
+    _, created = Subscription.objects.get_or_create(
+        user=user, following=following
+    )
+    if created:
+        following.followers_count += 1
+    following.is_subscribed = True
+    return following, created
+
+
+@transaction.atomic
+def __remove_subscription_orm(user, following_id):
+    if not User.objects.filter(pk=following_id).exists():
+        return False, False
+    deleted, _ = Subscription.objects.filter(
+        user=user, following_id=following_id
+    ).delete()
+    return True, bool(deleted)
+
+
+SYNC_ADD = "add"
+SYNC_REMOVE = "remove"
+SYNC_RELATIONS = {
+    "favorite": {
+        "model": UserFavoriteRecipes,
+        "field": "recipe_id",
+        "target": Recipe,
+        "counter": "favorites_count",
+        "flag": FAVORITED,
+        "exists": "Данный рецепт уже в избранных",
+        "missing": "Данный рецепт не был в избранных",
+    },
+    "shopping_cart": {
+        "model": UserShoppingCart,
+        "field": "recipe_id",
+        "target": Recipe,
+        "counter": "cart_count",
+        "flag": IN_SHOPPING_CART,
+        "exists": "Данный рецепт уже в корзине",
+        "missing": "Данный рецепт не был в корзине",
+    },
+    "subscribe": {
+        "model": Subscription,
+        "field": "following_id",
+        "target": User,
+        "counter": "followers_count",
+        "flag": SUBSCRIBED,
+        "exists": "Вы уже подписаны на этго пользователя",
+        "missing": "Нет подписки на данного пользователя",
+    },
+}
+
+
+@transaction.atomic
+def sync_user_relations(user, operations):
+    """
+    Применяет очередь операций {type, action, id} с избранным, корзиной
+    и подписками пользователя. Операции разбираются по порядку в памяти,
+    а в базу записывается только итоговая разница пакетными запросами.
+    Возвращает результаты операций с теми же статусами, что и у
+    одиночных запросов.
+    """
+    ids = {
+        target: {
+            operation["id"]
+            for operation in operations
+            if SYNC_RELATIONS[operation["type"]]["target"] is target
+        }
+        for target in (Recipe, User)
+    }
+    found = {
+        target: set(
+            target.objects.filter(pk__in=pks).values_list("pk", flat=True)
+        ) if pks else set()
+        for target, pks in ids.items()
+    }
+    initial = get_user_flags(user, ids[Recipe], ids[User])
+    state = set(initial)
+    results = []
+    for operation in operations:
+        relation = SYNC_RELATIONS[operation["type"]]
+        key = (relation["flag"], operation["id"])
+        result = dict(operation)
+        if operation["id"] not in found[relation["target"]]:
+            result.update(status=404, detail="Объект не найден")
+        elif relation["target"] is User and operation["id"] == user.pk:
+            result.update(status=400, detail="Подписка на себя запрещена")
+        elif operation["action"] == SYNC_ADD:
+            if key in state:
+                result.update(status=400, detail=relation["exists"])
+            else:
+                state.add(key)
+                result.update(status=201)
+        elif key in state:
+            state.remove(key)
+            result.update(status=204)
+        else:
+            result.update(status=400, detail=relation["missing"])
+        results.append(result)
+    __apply_relation_changes(user, state - initial, initial - state)
+    return results
+
+
+def __apply_relation_changes(user, added, removed):
+    for relation in SYNC_RELATIONS.values():
+        added_ids = [pk for flag, pk in added if flag == relation["flag"]]
+        removed_ids = [pk for flag, pk in removed if flag == relation["flag"]]
+        model_cls, field = relation["model"], relation["field"]
+        if removed_ids:
+            # Счётчики и списки покупок для удалённых связей обновляют
+            # сигналы post_delete. Удаление идёт до добавления: сигнал
+            # пересчитывает список по всей корзине, а добавленные рецепты
+            # учитывает запрос вставки.
+            model_cls.objects.filter(
+                user=user, **{f"{field}__in": removed_ids}
+            ).delete()
+        if added_ids:
+            __add_relations(relation, user, added_ids)
+
+
+def __add_relations(relation, user, pks):
+    model_cls, field = relation["model"], relation["field"]
+    if connection.vendor != "postgresql":
+        for pk in pks:
+            model_cls.objects.get_or_create(user=user, **{field: pk})
+        return
+    shopping_list = (
+        ADD_SHOPPING_LIST_SQL if model_cls is UserShoppingCart else ""
+    )
+    __fetch_one(
+        ADD_RELATIONS_SQL.replace("{shopping_list}", shopping_list),
+        {"user": user.pk, "ids": list(pks)},
+        relation=model_cls._meta.db_table,
+        field=field,
+        target=relation["target"]._meta.db_table,
+        counter=relation["counter"],
+    )
+
+
+def get_shopping_list_title(user):
+    return f"Список покупок {user.username}"
+
+
+def get_shopping_list_rows(user):
+    return (
+        ShoppingListItem.objects.filter(user=user)
         .values(
+            "amount",
             name=F("ingredient__name"),
             measurement_unit=F("ingredient__measurement_unit"),
         )
-        .annotate(amount=Sum("amount"))
+        .iterator()
+    )
+
+
+def get_shopping_list_etag(user, *parts):
+    """
+    Строгий ETag списка покупок: меняется вместе с составом списка.
+    """
+    items = (
+        ShoppingListItem.objects.filter(user=user)
+        .order_by("ingredient_id")
+        .values_list("ingredient_id", "amount")
     )
-    shopping_list = [f"Список покупок {user.username}"]
-    shopping_list.extend(
-        f'{ing["name"]}: {ing["amount"]} {ing["measurement_unit"]}'
-        for ing in ings
+    digest = sha1(
+        repr((user.username, parts, list(items))).encode("utf-8")
     )
-    shopping_list = "\n".join(shopping_list)
-    return shopping_list
+    return f'"{digest.hexdigest()}"'
@@ -0,0 +1,212 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeTag,
+                            ShortLink, Subscription, Tag, UserFavoriteRecipes,
+                            UserShoppingCart)
+from .cache import (INGREDIENTS_VERSION, PANTRY_VERSION, TAGS_VERSION,
+                    bump_versions, forget_short_link, invalidate_recipe,
+                    invalidate_recipes)
+from .pantry import pantry_index
+from .services import (get_cart_user_ids, invalidate_author,
+                       rebuild_shopping_lists, shift_counter)
+
+User = get_user_model()
+
+PRIVATE_USER_FIELDS = {"last_login", "password"}
+
+# Счётчики связей, созданных или удалённых через ORM (админка, каскадное
+# удаление, запасные пути для других СУБД): модель связи -> (модель
+# счётчика, поле со ссылкой на неё, поле счётчика). Пакетные вставки и
+# запросы на PostgreSQL сигналов не вызывают и сдвигают счётчики сами.
+COUNTERS = {
+    Recipe: (User, "author_id", "recipes_count"),
+    Subscription: (User, "following_id", "followers_count"),
+    UserFavoriteRecipes: (Recipe, "recipe_id", "favorites_count"),
+    UserShoppingCart: (Recipe, "recipe_id", "cart_count"),
+}
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=Subscription)
+@receiver(pre_save, sender=UserFavoriteRecipes)
+@receiver(pre_save, sender=UserShoppingCart)
+def counted_relation_saving(sender, instance, raw=False, **kwargs):
+    model_cls, field, counter = COUNTERS[sender]
+    instance._counted_previous = __get_previous(instance, field)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Subscription)
+@receiver(post_save, sender=UserFavoriteRecipes)
+@receiver(post_save, sender=UserShoppingCart)
+def counted_relation_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Новая связь увеличивает счётчик, перенос существующей на другую
+    запись (например, в админке) переносит и единицу счётчика.
+    """
+    if raw:
+        return
+    model_cls, field, counter = COUNTERS[sender]
+    for pk in instance._counted_previous.get(field, ()):
+        shift_counter(model_cls, pk, counter, -1)
+    if created or field in instance._counted_previous:
+        shift_counter(model_cls, getattr(instance, field), counter, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Subscription)
+@receiver(post_delete, sender=UserFavoriteRecipes)
+@receiver(post_delete, sender=UserShoppingCart)
+def counted_relation_deleted(sender, instance, **kwargs):
+    model_cls, field, counter = COUNTERS[sender]
+    shift_counter(model_cls, getattr(instance, field), counter, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_recipe(instance.pk))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: invalidate_recipe(pk))
+    transaction.on_commit(lambda: pantry_index.set_recipe(pk, ()))
+
+
+@receiver(post_delete, sender=ShortLink)
+def short_link_deleted(sender, instance, **kwargs):
+    link = instance.link
+    transaction.on_commit(lambda: forget_short_link(link))
+
+
+@receiver(post_save, sender=RecipeTag)
+@receiver(post_delete, sender=RecipeTag)
+def recipe_tag_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_recipe(instance.recipe_id))
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_recipe(instance.recipe_id))
+    transaction.on_commit(
+        lambda: pantry_index.reload_recipe(instance.recipe_id)
+    )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_m2m_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if reverse:
+        transaction.on_commit(invalidate_recipes)
+    else:
+        transaction.on_commit(lambda: invalidate_recipe(instance.pk))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def tag_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_recipes)
+    transaction.on_commit(lambda: bump_versions(TAGS_VERSION))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_recipes)
+    transaction.on_commit(
+        lambda: bump_versions(INGREDIENTS_VERSION, PANTRY_VERSION)
+    )
+
+
+# Списки покупок при изменениях корзин и ингредиентов рецептов через ORM
+# пересчитываются по суммам корзин затронутых пользователей. Пересчёт не
+# зависит от порядка сигналов, поэтому при каскадном удалении рецепта
+# корзины и ингредиенты, удалённые вместе, не вычитаются дважды.
+@receiver(pre_save, sender=UserShoppingCart)
+def shopping_cart_saving(sender, instance, raw=False, **kwargs):
+    instance._previous = __get_previous(instance, "user_id")
+
+
+@receiver(post_save, sender=UserShoppingCart)
+def shopping_cart_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        rebuild_shopping_lists(
+            {instance.user_id, *instance._previous.get("user_id", ())}
+        )
+
+
+@receiver(post_delete, sender=UserShoppingCart)
+def shopping_cart_deleted(sender, instance, **kwargs):
+    rebuild_shopping_lists((instance.user_id,))
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def recipe_ingredient_saving(sender, instance, raw=False, **kwargs):
+    instance._previous = __get_previous(
+        instance, "recipe_id", "ingredient_id"
+    )
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def recipe_ingredient_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = instance._previous
+    user_ids = set(get_cart_user_ids(instance.recipe_id))
+    for recipe_id in previous.get("recipe_id", ()):
+        user_ids.update(get_cart_user_ids(recipe_id))
+    rebuild_shopping_lists(
+        user_ids,
+        {instance.ingredient_id, *previous.get("ingredient_id", ())},
+    )
+
+
+@receiver(pre_delete, sender=RecipeIngredient)
+def recipe_ingredient_deleting(sender, instance, **kwargs):
+    instance._cart_user_ids = get_cart_user_ids(instance.recipe_id)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_ingredient_deleted(sender, instance, **kwargs):
+    rebuild_shopping_lists(instance._cart_user_ids, (instance.ingredient_id,))
+
+
+def __get_previous(instance, *fields):
+    """
+    Прежние значения полей сохраняемой записи {поле: (значение,)}, если
+    запись уже была в базе и значение изменилось.
+    """
+    if instance.pk is None:
+        return {}
+    row = (
+        type(instance).objects.filter(pk=instance.pk)
+        .values(*fields)
+        .first()
+    )
+    if row is None:
+        return {}
+    return {
+        field: (value,)
+        for field, value in row.items()
+        if value != getattr(instance, field)
+    }
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Профиль автора входит в представления его рецептов. Новые
+    пользователи и сохранения без полей профиля кэш не трогают, рецепты
+    удалённого пользователя сбрасываются при их каскадном удалении.
+    """
+    if created or update_fields and set(update_fields) <= PRIVATE_USER_FIELDS:
+        return
+    transaction.on_commit(lambda: invalidate_author(instance.pk))
@@ -0,0 +1,44 @@
+import os
+from hashlib import sha256
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранит загрузки в каталогах hashed_dirs под именем из sha256
+    содержимого. Одинаковые файлы хранятся один раз, повторная запись
+    тех же байтов только обновляет время изменения файла. Остальные
+    каталоги (например, копии изображений) хранятся как обычно.
+    """
+    hashed_dirs = ("recipes", "avatars")
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        if self.is_hashed(name):
+            name = self.get_hashed_name(name, content)
+            try:
+                # Повторная загрузка обновляет время изменения, чтобы
+                # collect_media --min-age не удалил файл, пока новая ссылка
+                # на него ещё не сохранена.
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                pass
+        return super().save(name, content, max_length)
+
+    def is_hashed(self, name):
+        return name.replace("\\", "/").split("/", 1)[0] in self.hashed_dirs
+
+    def get_hashed_name(self, name, content):
+        digest = sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory, filename = os.path.split(name)
+        _, ext = os.path.splitext(filename)
+        return os.path.join(directory, digest.hexdigest() + ext.lower())
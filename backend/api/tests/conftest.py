@@ -0,0 +1,141 @@
+from io import BytesIO
+from types import SimpleNamespace
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import connection
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeTag,
+                            Tag)
+
+User = get_user_model()
+
+
+@pytest.fixture(autouse=True)
+def isolated_media_and_cache(settings, tmp_path):
+    """
+    Загрузки пишутся во временный каталог, а версии и ответы хранятся
+    в отдельном кэше каждого теста.
+    """
+    settings.MEDIA_ROOT = tmp_path / "media"
+    settings.CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": str(tmp_path),
+        }
+    }
+
+
+@pytest.fixture(params=("postgresql", "orm"))
+def vendor(request, monkeypatch):
+    """
+    Запросы API идут и через SQL для PostgreSQL, и через ORM.
+    """
+    if request.param == "orm":
+        monkeypatch.setattr(
+            "api.services.connection", SimpleNamespace(vendor="sqlite")
+        )
+    elif connection.vendor != "postgresql":
+        pytest.skip("нужен PostgreSQL")
+    return request.param
+
+
+def make_image(size=(40, 30), image_format="PNG"):
+    buffer = BytesIO()
+    Image.new("RGB", size, (200, 100, 50)).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def make_user(username, **extra):
+    return User.objects.create_user(
+        username=username,
+        email=f"{username}@example.com",
+        password="realystrongpassword1352",
+        first_name=username.capitalize(),
+        last_name="Тестов",
+        **extra,
+    )
+
+
+@pytest.fixture
+def author(db):
+    user = make_user("author")
+    user.avatar.save("author.png", ContentFile(make_image()))
+    return user
+
+
+@pytest.fixture
+def user(db):
+    return make_user("reader")
+
+
+@pytest.fixture
+def client():
+    return APIClient()
+
+
+@pytest.fixture
+def user_client(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+@pytest.fixture
+def author_client(author):
+    client = APIClient()
+    client.force_authenticate(author)
+    return client
+
+
+@pytest.fixture
+def tags(db):
+    return [
+        Tag.objects.create(name="Завтрак", slug="breakfast"),
+        Tag.objects.create(name="Обед", slug="lunch"),
+        Tag.objects.create(name="Ужин", slug="dinner"),
+    ]
+
+
+@pytest.fixture
+def ingredients(db):
+    return [
+        Ingredient.objects.create(name=name, measurement_unit=unit)
+        for name, unit in (
+            ("Ёжевика", "г"),
+            ("Яблоки", "г"),
+            ("Яйца", "шт."),
+            ("Молоко", "мл"),
+            ("Мука", "г"),
+        )
+    ]
+
+
+@pytest.fixture
+def make_recipe(author, tags, ingredients):
+    """
+    Создаёт рецепт автора с тэгами и ингредиентами {ингредиент: количество}.
+    """
+    def make(name="Блины", author=author, tags=tags[:2], amounts=None,
+             image=True):
+        if amounts is None:
+            amounts = {ingredients[2]: 2, ingredients[3]: 500}
+        recipe = Recipe.objects.create(
+            author=author, name=name, text="Описание", cooking_time=20
+        )
+        if image:
+            recipe.image.save(
+                f"{name}.png", ContentFile(make_image()), save=True
+            )
+        for tag in tags:
+            RecipeTag.objects.create(recipe=recipe, tag=tag)
+        for ingredient, amount in amounts.items():
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )
+        return recipe
+
+    return make
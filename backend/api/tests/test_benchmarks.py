@@ -0,0 +1,204 @@
+"""
+Замеры производительности. По умолчанию не запускаются:
+
+    pytest -m benchmark -s
+"""
+import base64
+import os
+import random
+import timeit
+import tracemalloc
+from csv import DictReader
+from io import BytesIO
+from string import ascii_letters, digits
+
+import pytest
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.dictionaries import ingredient_index
+from api.serializers import RecipeSerializer
+from api.services import set_user_flags
+from api.utils import Base64ImageField, encode_short_link
+from api.views import UserViewSet
+from recipes.models import Ingredient, Recipe
+
+from .conftest import make_user
+
+pytestmark = [pytest.mark.benchmark, pytest.mark.django_db]
+
+
+def report(name, baseline, optimized):
+    print(
+        f"\n{name}: {baseline:.4f}s -> {optimized:.4f}s "
+        f"({baseline / optimized:.1f}x)"
+    )
+
+
+def report_memory(name, baseline, optimized):
+    print(
+        f"\n{name}: {baseline / 2 ** 20:.1f} MiB -> "
+        f"{optimized / 2 ** 20:.1f} MiB ({baseline / optimized:.1f}x)"
+    )
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def noise_image():
+    """
+    PNG из шума около 6 МБ: почти не сжимается, как фотография.
+    """
+    buffer = BytesIO()
+    Image.frombytes("RGB", (1400, 1400), os.urandom(1400 * 1400 * 3)).save(
+        buffer, "PNG"
+    )
+    return buffer.getvalue()
+
+
+def test_recipe_serialization(make_recipe, user):
+    for number in range(30):
+        make_recipe(f"Рецепт {number}")
+    request = Request(APIRequestFactory().get("/"))
+    request.user = user
+    context = {"request": request}
+    recipes = set_user_flags(
+        list(Recipe.detailed.with_details()), request.user
+    )
+
+    def field_path():
+        for recipe in recipes:
+            serializers.ModelSerializer.to_representation(
+                RecipeSerializer(context=context), recipe
+            )
+
+    def dict_path():
+        for recipe in recipes:
+            RecipeSerializer(recipe, context=context).data
+
+    baseline = min(timeit.repeat(field_path, number=20, repeat=3))
+    optimized = min(timeit.repeat(dict_path, number=20, repeat=3))
+    report("RecipeSerializer, 30 рецептов x 20", baseline, optimized)
+    assert optimized * 2 < baseline
+
+
+def test_ingredient_prefix_search():
+    with open(
+        os.path.join(settings.SEEDDATA_DIR, "ingredients.csv"),
+        encoding="utf-8",
+    ) as rows:
+        Ingredient.objects.bulk_create(
+            Ingredient(
+                name=row["name"], measurement_unit=row["measurement_unit"]
+            )
+            for row in DictReader(rows)
+        )
+    prefixes = ["с", "са", "сах", "мол", "к", "кар", "я", "Ябл", "х", "ч"]
+    ingredient_index.refresh()
+
+    def database_path():
+        for prefix in prefixes:
+            list(
+                Ingredient.objects.filter(name__istartswith=prefix)
+                .values("id", "name", "measurement_unit")
+            )
+
+    def index_path():
+        for prefix in prefixes:
+            ingredient_index.search(prefix)
+
+    baseline = min(timeit.repeat(database_path, number=20, repeat=3))
+    optimized = min(timeit.repeat(index_path, number=20, repeat=3))
+    report("Поиск ингредиента по префиксу, 10 x 20", baseline, optimized)
+    assert optimized * 10 < baseline
+
+
+def test_short_link_allocation_at_million_links():
+    rng = random.Random(1)
+    chars = ascii_letters + digits
+    # Прежний генератор перебирал выгрузку всех ссылок в виде словарей.
+    links = [
+        {"link": "".join(rng.choice(chars) for _ in range(5))}
+        for _ in range(1_000_000)
+    ]
+
+    def scan_path():
+        link = "".join(rng.choice(chars) for _ in range(5))
+        return link in links
+
+    codes = set(map(encode_short_link, range(1, 1_000_001)))
+    assert len(codes) == 1_000_000
+    baseline = min(timeit.repeat(scan_path, number=10, repeat=3))
+    optimized = min(
+        timeit.repeat(
+            lambda: encode_short_link(rng.randrange(1_000_000)),
+            number=10,
+            repeat=3,
+        )
+    )
+    report("Новая короткая ссылка при 1M ссылок, x 10", baseline, optimized)
+    assert optimized * 100 < baseline
+
+
+def test_base64_image_memory():
+    content = noise_image()
+    encoded = base64.b64encode(content).decode()
+    data = f"data:image/png;base64,{encoded}"
+
+    def full_decode():
+        # Прежний путь: копия без заголовка, все байты в памяти и проверка
+        # Pillow по ним.
+        _, imgstr = data.split(";base64,")
+        serializers.ImageField().to_internal_value(
+            ContentFile(base64.b64decode(imgstr), name="temp.png")
+        )
+
+    def chunked_decode():
+        Base64ImageField().to_internal_value(data).close()
+
+    baseline = peak_memory(full_decode)
+    optimized = peak_memory(chunked_decode)
+    report_memory(
+        f"base64, {len(content) / 2 ** 20:.1f} MiB", baseline, optimized
+    )
+    assert optimized * 4 < baseline
+
+
+def test_binary_upload_memory(settings):
+    content = noise_image()
+    user = make_user("uploader")
+    view = UserViewSet.as_view({"put": "avatar"}, **UserViewSet.avatar.kwargs)
+
+    def upload():
+        request = APIRequestFactory().put(
+            "/api/users/me/avatar/", content, content_type="image/png"
+        )
+        force_authenticate(request, user)
+        return request
+
+    def measure(memory_size):
+        settings.FILE_UPLOAD_MAX_MEMORY_SIZE = memory_size
+        request = upload()
+        responses = []
+        peak = peak_memory(lambda: responses.append(view(request).render()))
+        assert responses[0].status_code == 200, responses[0].data
+        return peak
+
+    baseline = measure(len(content) * 2)
+    optimized = measure(512 * 1024)
+    report_memory(
+        f"Загрузка файлом, {len(content) / 2 ** 20:.1f} MiB",
+        baseline,
+        optimized,
+    )
+    assert optimized * 4 < baseline
@@ -0,0 +1,59 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from django.db import connection
+
+from api import cache
+
+
+def count_in_threads(sequence, threads=8, calls=50):
+    def work():
+        try:
+            for _ in range(calls):
+                cache.__count(sequence)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return threads * calls
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("flush_interval", (0, 60))
+def test_concurrent_hits_are_not_lost(monkeypatch, flush_interval):
+    if connection.vendor != "postgresql":
+        pytest.skip("нужен PostgreSQL")
+    monkeypatch.setattr(cache, "STATS_FLUSH_INTERVAL", flush_interval)
+    before = cache.get_stats()
+    counted = count_in_threads(cache.HITS)
+    assert cache.get_stats() == {
+        "hits": before["hits"] + counted, "misses": before["misses"]
+    }
+
+
+def test_other_databases_count_in_process(monkeypatch):
+    monkeypatch.setattr(
+        "api.cache.connection", SimpleNamespace(vendor="sqlite")
+    )
+    before = cache.get_stats()
+    counted = count_in_threads(cache.MISSES)
+    assert cache.get_stats() == {
+        "hits": before["hits"], "misses": before["misses"] + counted
+    }
+
+
+@pytest.mark.django_db
+def test_anonymous_responses_are_counted(make_recipe, client):
+    recipe = make_recipe()
+    before = cache.get_stats()
+    for _ in range(3):
+        response = client.get(f"/api/recipes/{recipe.pk}/")
+        assert response.status_code == 200
+    after = cache.get_stats()
+    assert after["misses"] - before["misses"] == 1
+    assert after["hits"] - before["hits"] == 2
@@ -0,0 +1,44 @@
+import pytest
+
+from recipes.models import (Recipe, Subscription, User, UserFavoriteRecipes,
+                            UserShoppingCart)
+
+from .conftest import make_user
+from .test_shopping_lists import assert_consistent
+
+
+@pytest.mark.django_db
+def test_reassigned_relations_move_counters(make_recipe, author, user):
+    """
+    Перенос связи на другую запись, как при правке в админке, уменьшает
+    счётчик прежней записи и увеличивает счётчик новой.
+    """
+    first, second = make_recipe(), make_recipe("Омлет")
+    other = make_user("other")
+    favorite = UserFavoriteRecipes.objects.create(user=user, recipe=first)
+    cart = UserShoppingCart.objects.create(user=user, recipe=first)
+    subscription = Subscription.objects.create(user=user, following=author)
+
+    favorite.recipe = second
+    favorite.save()
+    cart.recipe = second
+    cart.save()
+    subscription.following = other
+    subscription.save()
+    recipe = Recipe.objects.get(pk=first.pk)
+    recipe.author = other
+    recipe.save()
+
+    assert list(
+        Recipe.objects.order_by("id")
+        .values_list("favorites_count", "cart_count")
+    ) == [(0, 0), (1, 1)]
+    assert dict(
+        User.objects.filter(pk__in=(author.pk, other.pk))
+        .values_list("pk", "followers_count")
+    ) == {author.pk: 0, other.pk: 1}
+    assert dict(
+        User.objects.filter(pk__in=(author.pk, other.pk))
+        .values_list("pk", "recipes_count")
+    ) == {author.pk: 1, other.pk: 1}
+    assert_consistent()
@@ -0,0 +1,32 @@
+import gzip
+import json
+
+import pytest
+
+
+@pytest.mark.django_db
+def test_tag_snapshot_etag_differs_per_content_encoding(client, tags):
+    plain = client.get("/api/tags/")
+    gzipped = client.get("/api/tags/", HTTP_ACCEPT_ENCODING="gzip")
+    assert plain["ETag"] != gzipped["ETag"]
+    assert gzipped["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(gzipped.content)) == plain.json()
+    assert len(plain.json()) == len(tags)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("encoding", ("", "gzip"))
+def test_tag_snapshot_not_modified_only_for_matching_etag(
+    client, tags, encoding
+):
+    etag = client.get("/api/tags/", HTTP_ACCEPT_ENCODING=encoding)["ETag"]
+    response = client.get(
+        "/api/tags/", HTTP_ACCEPT_ENCODING=encoding, HTTP_IF_NONE_MATCH=etag
+    )
+    assert response.status_code == 304
+    assert response["ETag"] == etag
+    other = "gzip" if not encoding else ""
+    response = client.get(
+        "/api/tags/", HTTP_ACCEPT_ENCODING=other, HTTP_IF_NONE_MATCH=etag
+    )
+    assert response.status_code == 200
@@ -0,0 +1,80 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.db import connection
+
+from api import images
+from api.images import (VARIANT_FORMATS, VARIANT_WIDTHS, build_variants,
+                        get_variant_urls, mark_variants_built,
+                        schedule_variants)
+from api.serializers import RecipeMinifiedSerializer
+from recipes.models import Recipe, User
+
+from .conftest import make_image
+
+
+@pytest.mark.django_db
+def test_variants_appear_after_build(make_recipe, monkeypatch):
+    first, second = make_recipe(), make_recipe("Омлет")
+    assert first.image.name == second.image.name
+
+    def exists(*args):
+        raise AssertionError("Сериализатор не должен проверять хранилище")
+
+    monkeypatch.setattr(FileSystemStorage, "exists", exists)
+    assert RecipeMinifiedSerializer(first).data["image_variants"] is None
+    mark_variants_built((first.image.name,))
+    for recipe in Recipe.objects.all():
+        variants = RecipeMinifiedSerializer(recipe).data["image_variants"]
+        assert set(variants) == {str(width) for width in VARIANT_WIDTHS}
+        for urls in variants.values():
+            assert set(urls) == set(VARIANT_FORMATS)
+
+
+@pytest.mark.django_db
+def test_new_image_hides_old_variants(make_recipe):
+    recipe = make_recipe()
+    mark_variants_built((recipe.image.name,))
+    recipe.refresh_from_db()
+    assert get_variant_urls(recipe.image, recipe.built_variants)
+    recipe.image.save(
+        "new.png", ContentFile(make_image((50, 50))), save=True
+    )
+    recipe.refresh_from_db()
+    assert get_variant_urls(recipe.image, recipe.built_variants) is None
+
+
+@pytest.mark.django_db
+def test_command_marks_existing_variants(make_recipe, author):
+    recipe = make_recipe()
+    written = build_variants(recipe.image.name, recipe.image.storage)
+    assert written == len(VARIANT_WIDTHS) * len(VARIANT_FORMATS)
+    call_command("build_image_variants")
+    recipe.refresh_from_db()
+    author = User.objects.get(pk=author.pk)
+    assert recipe.built_variants == recipe.image.name
+    assert author.built_variants == author.avatar.name
+
+
+@pytest.mark.django_db(transaction=True)
+def test_variant_workers_close_connections(make_recipe, monkeypatch):
+    closed = []
+
+    def close():
+        closed.append(threading.current_thread().name)
+        connection.close()
+
+    monkeypatch.setattr("api.images.connection", SimpleNamespace(close=close))
+    recipe = make_recipe()
+    done = threading.Event()
+    schedule_variants(recipe.image, done.set)
+    assert done.wait(10)
+    images.__get_executor().submit(lambda: None).result()
+    assert len(closed) == 1
+    assert closed[0].startswith("image-variants")
+    recipe.refresh_from_db()
+    assert recipe.built_variants == recipe.image.name
@@ -0,0 +1,91 @@
+import base64
+import json
+from types import SimpleNamespace
+
+import pytest
+from django.db import connection
+
+from api.imports import import_recipes
+from recipes.models import Recipe, RecipeIngredient, User
+
+from .conftest import make_image
+
+
+@pytest.fixture(params=("postgresql", "other"))
+def import_vendor(request, monkeypatch):
+    """
+    Id рецептов резервируются последовательностью PostgreSQL или берутся
+    после максимального в остальных базах.
+    """
+    if request.param == "other":
+        monkeypatch.setattr(
+            "api.imports.connection", SimpleNamespace(vendor="sqlite")
+        )
+    elif connection.vendor != "postgresql":
+        pytest.skip("нужен PostgreSQL")
+    return request.param
+
+
+def line(tags, ingredients, name="Импорт"):
+    return json.dumps(
+        {
+            "name": name,
+            "text": "Описание",
+            "cooking_time": 10,
+            "tags": [tag.pk for tag in tags],
+            "ingredients": [
+                {"id": ingredient.pk, "amount": amount}
+                for ingredient, amount in ingredients
+            ],
+        }
+    )
+
+
+@pytest.mark.django_db
+def test_import_links_tags_and_ingredients(
+    import_vendor, make_recipe, author, tags, ingredients
+):
+    make_recipe()
+    lines = [
+        line(tags[:2], [(ingredients[0], 5), (ingredients[1], 7)], f"И {n}")
+        for n in range(3)
+    ]
+    report = import_recipes(lines, author, chunk_size=2)
+    assert report["errors"] == []
+    created = [row["id"] for row in report["created"]]
+    assert [row["line"] for row in report["created"]] == [1, 2, 3]
+    assert len(set(created)) == 3
+    for pk in created:
+        recipe = Recipe.objects.get(pk=pk)
+        assert set(recipe.tags.values_list("pk", flat=True)) == {
+            tag.pk for tag in tags[:2]
+        }
+        assert dict(
+            RecipeIngredient.objects.filter(recipe=recipe)
+            .values_list("ingredient_id", "amount")
+        ) == {ingredients[0].pk: 5, ingredients[1].pk: 7}
+    assert User.objects.get(pk=author.pk).recipes_count == 4
+
+
+@pytest.mark.django_db
+def test_import_and_api_report_the_same_errors(
+    author, author_client, tags, ingredients
+):
+    cases = (
+        ([tags[0], tags[0]], [(ingredients[0], 1)], "tags"),
+        (tags[:1], [(ingredients[0], 1), (ingredients[0], 2)],
+         "ingredients"),
+    )
+    for recipe_tags, recipe_ingredients, field in cases:
+        data = line(recipe_tags, recipe_ingredients)
+        report = import_recipes([data], author)
+        image = base64.b64encode(make_image()).decode()
+        response = author_client.post(
+            "/api/recipes/",
+            {**json.loads(data), "image": f"data:image/png;base64,{image}"},
+            format="json",
+        )
+        assert response.status_code == 400
+        assert report["errors"][0]["errors"][field] == (
+            response.json()["non_field_errors"]
+        )
@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+
+import pytest
+from django.core.cache import cache
+
+from api.cache import PANTRY_CHANGE
+from api.pantry import PantryIndex
+from recipes.models import RecipeIngredient
+
+
+@pytest.fixture
+def recipes(make_recipe, ingredients):
+    return [
+        make_recipe("Блины", amounts={ingredients[2]: 2, ingredients[3]: 1}),
+        make_recipe("Омлет", amounts={ingredients[2]: 3}),
+    ]
+
+
+@pytest.fixture
+def count_builds(monkeypatch):
+    builds = []
+    build = PantryIndex.build
+
+    def counted(index):
+        builds.append(index)
+        build(index)
+
+    monkeypatch.setattr(PantryIndex, "build", counted)
+    return builds
+
+
+@pytest.mark.django_db
+def test_match_orders_by_share_of_available_ingredients(
+    recipes, ingredients
+):
+    index = PantryIndex()
+    assert index.match([ingredients[2].pk], 10) == [
+        (recipes[1].pk, 1, 1),
+        (recipes[0].pk, 1, 2),
+    ]
+
+
+@pytest.mark.django_db
+def test_set_recipe_updates_all_processes_without_rebuild(
+    recipes, ingredients, count_builds
+):
+    local, other = PantryIndex(), PantryIndex()
+    local.refresh()
+    other.refresh()
+    local.set_recipe(recipes[1].pk, [str(ingredients[4].pk)])
+    local.set_recipe(recipes[0].pk, ())
+    for index in (local, other):
+        assert index.match([ingredients[4].pk], 10) == [
+            (recipes[1].pk, 1, 1)
+        ]
+        assert index.match([ingredients[2].pk], 10) == []
+        assert ingredients[2].pk not in index.postings
+    assert len(count_builds) == 2
+
+
+@pytest.mark.django_db
+def test_lost_change_forces_rebuild(recipes, ingredients, count_builds):
+    local, other = PantryIndex(), PantryIndex()
+    local.refresh()
+    other.refresh()
+    local.set_recipe(recipes[1].pk, [ingredients[4].pk])
+    cache.delete(PANTRY_CHANGE.format(local.sequence))
+    other.refresh()
+    assert count_builds == [local, other, other]
+
+
+@pytest.mark.django_db
+def test_concurrent_writers_get_distinct_changes(
+    recipes, ingredients, count_builds
+):
+    first, second, reader = PantryIndex(), PantryIndex(), PantryIndex()
+    for index in (first, second, reader):
+        index.refresh()
+    first.set_recipe(recipes[0].pk, [ingredients[0].pk])
+    second.set_recipe(recipes[1].pk, [ingredients[1].pk])
+    assert first.sequence != second.sequence
+    assert reader.match([ingredients[0].pk, ingredients[1].pk], 10) == [
+        (recipes[1].pk, 1, 1),
+        (recipes[0].pk, 1, 1),
+    ]
+    assert len(count_builds) == 3
+
+
+@pytest.mark.django_db
+def test_other_databases_rebuild_on_change(
+    recipes, ingredients, count_builds, monkeypatch
+):
+    monkeypatch.setattr(
+        "api.pantry.connection", SimpleNamespace(vendor="sqlite")
+    )
+    local, other = PantryIndex(), PantryIndex()
+    local.refresh()
+    other.refresh()
+    RecipeIngredient.objects.filter(recipe=recipes[1]).update(
+        ingredient=ingredients[4]
+    )
+    local.set_recipe(recipes[1].pk, [ingredients[4].pk])
+    assert other.match([ingredients[4].pk], 10) == [(recipes[1].pk, 1, 1)]
+    assert count_builds == [local, other, other]
@@ -0,0 +1,87 @@
+import base64
+from types import SimpleNamespace
+
+import pytest
+from django.db import connection
+
+from recipes.models import Recipe
+
+
+@pytest.fixture(params=("postgresql", "other"))
+def search_vendor(request, monkeypatch):
+    """
+    Поиск идёт по полнотекстовому индексу PostgreSQL или сравнением
+    строк в остальных базах.
+    """
+    if request.param == "other":
+        monkeypatch.setattr(
+            "api.utils.connection", SimpleNamespace(vendor="sqlite")
+        )
+    elif connection.vendor != "postgresql":
+        pytest.skip("нужен PostgreSQL")
+    return request.param
+
+
+def get_ids(client, query):
+    response = client.get(f"/api/recipes/?{query}")
+    assert response.status_code == 200
+    return [recipe["id"] for recipe in response.json()["results"]]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("query", ("пирог", "ПИРОГ", "Пирог"))
+def test_search_ignores_case_of_cyrillic(
+    search_vendor, make_recipe, client, query
+):
+    pie = make_recipe("Пирог с вишней")
+    make_recipe("Блины")
+    assert get_ids(client, f"search={query}") == [pie.pk]
+
+
+def get_page(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    data = response.json()
+    return [recipe["id"] for recipe in data["results"]], data
+
+
+@pytest.mark.django_db
+def test_cursor_walks_recipes_with_equal_pub_dates(make_recipe, client):
+    recipes = [make_recipe(f"Рецепт {number}") for number in range(7)]
+    Recipe.objects.filter(
+        pk__in=[recipe.pk for recipe in recipes[1:6]]
+    ).update(pub_date=recipes[0].pub_date)
+    expected = list(
+        Recipe.objects.order_by("-pub_date", "-id")
+        .values_list("id", flat=True)
+    )
+
+    pages, url = [], "/api/recipes/?cursor=&limit=2"
+    while url:
+        ids, data = get_page(client, url)
+        pages.append((ids, data))
+        url = data["next"]
+    assert [pk for ids, data in pages for pk in ids] == expected
+    assert pages[0][1]["previous"] is None
+
+    backwards, url = [], pages[-1][1]["previous"]
+    while url:
+        ids, data = get_page(client, url)
+        backwards.append(ids)
+        url = data["previous"]
+    assert backwards == [ids for ids, data in reversed(pages[:-1])]
+
+
+@pytest.mark.django_db
+def test_cursor_with_search_is_rejected(make_recipe, client):
+    make_recipe()
+    response = client.get("/api/recipes/?cursor=&search=блины")
+    assert response.status_code == 400
+    assert "cursor" in response.json()
+
+
+@pytest.mark.django_db
+def test_invalid_cursor_position(client):
+    cursor = base64.b64encode(b"p=garbage").decode()
+    response = client.get(f"/api/recipes/?cursor={cursor}")
+    assert response.status_code == 404
@@ -0,0 +1,85 @@
+import pytest
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.serializers import (RecipeMinifiedSerializer, RecipeSerializer,
+                             UserSerializer, UserWithRecipesSerializer)
+from api.services import set_latest_recipes, set_user_flags
+from recipes.models import Recipe, User, UserFavoriteRecipes
+
+render = JSONRenderer().render
+
+
+def field_representation(serializer, instance):
+    """
+    Представление через поля DRF — эталон для быстрых to_representation.
+    """
+    return serializers.ModelSerializer.to_representation(serializer, instance)
+
+
+@pytest.fixture
+def context(user):
+    request = Request(APIRequestFactory().get("/"))
+    request.user = user
+    return {"request": request}
+
+
+@pytest.fixture
+def recipes(make_recipe, author, user, tags, ingredients):
+    recipes = [
+        make_recipe(),
+        make_recipe(
+            "Шарлотка",
+            tags=tags,
+            amounts={ingredients[0]: 100, ingredients[1]: 3},
+        ),
+        make_recipe("Омлет", author=user, tags=tags[2:], image=False),
+    ]
+    UserFavoriteRecipes.objects.create(user=user, recipe=recipes[0])
+    return list(Recipe.detailed.with_details().order_by("id"))
+
+
+@pytest.mark.django_db
+def test_recipe_serializer_matches_field_output(recipes, context):
+    set_user_flags(recipes, context["request"].user)
+    for recipe in recipes:
+        expected = field_representation(
+            RecipeSerializer(context=context), recipe
+        )
+        expected["image"] = recipe.image.url if recipe.image else None
+        assert render(RecipeSerializer(recipe, context=context).data) == (
+            render(expected)
+        )
+
+
+@pytest.mark.django_db
+def test_recipe_minified_serializer_matches_field_output(recipes):
+    for recipe in recipes:
+        assert render(RecipeMinifiedSerializer(recipe).data) == render(
+            field_representation(RecipeMinifiedSerializer(), recipe)
+        )
+
+
+@pytest.mark.django_db
+def test_user_serializer_matches_field_output(recipes, user):
+    for instance in User.detailed.is_subscribed(user).order_by("id"):
+        assert render(UserSerializer(instance).data) == render(
+            field_representation(UserSerializer(), instance)
+        )
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("limit", (None, 1))
+def test_user_with_recipes_serializer_matches_field_output(
+    recipes, user, author, context, limit
+):
+    authors = set_latest_recipes(
+        list(User.detailed.is_subscribed(user).order_by("id")), limit
+    )
+    for instance in authors:
+        serializer = UserWithRecipesSerializer(context=context)
+        assert render(
+            UserWithRecipesSerializer(instance, context=context).data
+        ) == render(field_representation(serializer, instance))
@@ -0,0 +1,173 @@
+import pytest
+
+from api.services import get_cart_amounts
+from recipes.models import (RecipeIngredient, ShoppingListItem,
+                            UserShoppingCart)
+
+
+def assert_consistent():
+    """
+    Списки покупок совпадают с суммами ингредиентов рецептов в корзинах.
+    """
+    actual = {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount
+        in ShoppingListItem.objects.values_list(
+            "user_id", "ingredient_id", "amount"
+        )
+    }
+    assert actual == get_cart_amounts()
+
+
+@pytest.fixture
+def recipes(make_recipe, ingredients):
+    return [
+        make_recipe(),
+        make_recipe(
+            "Омлет", amounts={ingredients[2]: 3, ingredients[3]: 100}
+        ),
+        make_recipe("Шарлотка", amounts={ingredients[1]: 300}),
+    ]
+
+
+@pytest.fixture
+def carts(recipes, user, author):
+    for cart_user, recipe in ((user, recipes[0]), (user, recipes[1]),
+                              (author, recipes[1])):
+        UserShoppingCart.objects.create(user=cart_user, recipe=recipe)
+    assert_consistent()
+    assert ShoppingListItem.objects.filter(user=user).count() == 2
+
+
+def recipe_data(recipe, tags, amounts):
+    return {
+        "name": recipe.name,
+        "text": recipe.text,
+        "cooking_time": recipe.cooking_time,
+        "tags": [tag.pk for tag in tags],
+        "ingredients": [
+            {"id": ingredient.pk, "amount": amount}
+            for ingredient, amount in amounts.items()
+        ],
+    }
+
+
+@pytest.mark.django_db
+def test_api_cart_add_and_remove(vendor, carts, recipes, user_client):
+    url = f"/api/recipes/{recipes[2].pk}/shopping_cart/"
+    assert user_client.post(url).status_code == 201
+    assert_consistent()
+    url = f"/api/recipes/{recipes[0].pk}/shopping_cart/"
+    assert user_client.delete(url).status_code == 204
+    assert_consistent()
+
+
+@pytest.mark.django_db
+def test_sync(carts, recipes, user_client):
+    response = user_client.post(
+        "/api/sync/",
+        {
+            "operations": [
+                {"type": "shopping_cart", "action": "remove",
+                 "id": recipes[1].pk},
+                {"type": "shopping_cart", "action": "add",
+                 "id": recipes[2].pk},
+            ]
+        },
+        format="json",
+    )
+    assert response.status_code == 200
+    assert_consistent()
+
+
+@pytest.mark.django_db
+def test_recipe_update_changes_ingredients(
+    carts, recipes, tags, ingredients, author_client
+):
+    response = author_client.patch(
+        f"/api/recipes/{recipes[1].pk}/",
+        recipe_data(
+            recipes[1], tags[:1], {ingredients[2]: 5, ingredients[4]: 200}
+        ),
+        format="json",
+    )
+    assert response.status_code == 200
+    assert_consistent()
+
+
+@pytest.mark.django_db
+def test_recipe_delete(carts, recipes, author_client):
+    response = author_client.delete(f"/api/recipes/{recipes[1].pk}/")
+    assert response.status_code == 204
+    assert_consistent()
+
+
+@pytest.mark.django_db
+def test_author_delete_cascades(carts, author):
+    author.delete()
+    assert_consistent()
+    assert not ShoppingListItem.objects.exists()
+
+
+@pytest.mark.django_db
+def test_orm_cart_changes(carts, recipes, user, author):
+    UserShoppingCart.objects.create(user=user, recipe=recipes[2])
+    assert_consistent()
+    cart = UserShoppingCart.objects.get(user=author, recipe=recipes[1])
+    cart.user = user
+    cart.recipe = recipes[0]
+    UserShoppingCart.objects.filter(user=user, recipe=recipes[0]).delete()
+    cart.save()
+    assert_consistent()
+    UserShoppingCart.objects.filter(user=user).delete()
+    assert_consistent()
+    assert not ShoppingListItem.objects.exists()
+
+
+@pytest.mark.django_db
+def test_orm_recipe_ingredient_changes(carts, recipes, ingredients):
+    RecipeIngredient.objects.create(
+        recipe=recipes[1], ingredient=ingredients[0], amount=50
+    )
+    assert_consistent()
+    item = RecipeIngredient.objects.get(
+        recipe=recipes[1], ingredient=ingredients[2]
+    )
+    item.amount = 7
+    item.save()
+    assert_consistent()
+    item.recipe = recipes[2]
+    item.ingredient = ingredients[4]
+    item.save()
+    assert_consistent()
+    RecipeIngredient.objects.filter(recipe=recipes[0]).delete()
+    assert_consistent()
+
+
+@pytest.mark.django_db
+def test_download_matches_carts(carts, recipes, user, user_client):
+    response = user_client.get(
+        "/api/recipes/download_shopping_cart/", HTTP_ACCEPT="text/csv"
+    )
+    assert response.status_code == 200
+    content = b"".join(response.streaming_content).decode("utf-8")
+    for (user_id, ingredient_id), amount in get_cart_amounts().items():
+        if user_id == user.pk:
+            assert str(amount) in content
+
+
+@pytest.mark.django_db(transaction=True)
+def test_orm_writes_outside_transaction(recipes, user, ingredients):
+    """
+    Одиночные save() и delete() без atomic() тоже обновляют списки:
+    select_for_update в обработчиках работает в своей транзакции.
+    """
+    cart = UserShoppingCart.objects.create(user=user, recipe=recipes[0])
+    assert_consistent()
+    RecipeIngredient.objects.create(
+        recipe=recipes[0], ingredient=ingredients[0], amount=50
+    )
+    assert_consistent()
+    cart.delete()
+    assert_consistent()
+    assert not ShoppingListItem.objects.exists()
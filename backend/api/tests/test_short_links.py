@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from api.utils import (SHORT_LINK_ALPHABET, SHORT_LINK_LENGTH,
+                       SHORT_LINK_SPACE, encode_short_link,
+                       get_or_create_short_link)
+from recipes.models import ShortLink
+
+
+def sample_ids():
+    """
+    Подряд идущие id, случайные id со всего пространства кодов и его края.
+    """
+    rng = random.Random(20261017)
+    ids = set(range(1, 100_001))
+    ids.update(rng.randrange(SHORT_LINK_SPACE) for _ in range(100_000))
+    ids.update((0, SHORT_LINK_SPACE - 2, SHORT_LINK_SPACE - 1))
+    return ids
+
+
+def test_codes_are_unique_and_fixed_length():
+    ids = sample_ids()
+    codes = {encode_short_link(pk) for pk in ids}
+    assert len(codes) == len(ids)
+    for code in codes:
+        assert len(code) == SHORT_LINK_LENGTH
+        assert set(code) <= set(SHORT_LINK_ALPHABET)
+
+
+def test_codes_wrap_around_the_code_space():
+    assert encode_short_link(SHORT_LINK_SPACE + 7) == encode_short_link(7)
+
+
+@pytest.mark.django_db
+def test_get_link_is_stable_and_resolves(make_recipe, client, settings):
+    settings.SHORT_LINK_REDIRECT = False
+    recipes = [make_recipe(f"Рецепт {number}") for number in range(3)]
+    links = [get_or_create_short_link(recipe.pk) for recipe in recipes]
+    assert links == [get_or_create_short_link(recipe.pk) for recipe in recipes]
+    assert ShortLink.objects.count() == len(recipes)
+    response = client.get(
+        f"/api/recipes/{recipes[1].pk}/get-link/", HTTP_HOST="testserver"
+    )
+    assert response.json() == {"short-link": f"testserver/s/{links[1]}"}
+    response = client.get(f"/api/s/{links[1]}/")
+    assert response.status_code == 200
+    assert response.json()["id"] == recipes[1].pk
+    assert client.get("/api/s/00000000/").status_code == 404
@@ -0,0 +1,32 @@
+import os
+import time
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+
+from api.storage import ContentAddressedStorage
+
+from .conftest import make_image
+
+
+def test_duplicate_upload_survives_collect_media(db):
+    storage = ContentAddressedStorage()
+    name = storage.save("recipes/first.png", ContentFile(make_image()))
+    day_ago = time.time() - 24 * 60 * 60
+    os.utime(storage.path(name), (day_ago, day_ago))
+
+    assert storage.save(
+        "recipes/second.png", ContentFile(make_image())
+    ) == name
+    assert os.path.getmtime(storage.path(name)) > day_ago + 60
+    call_command("collect_media", min_age=3600)
+    assert storage.exists(name)
+
+
+def test_orphan_older_than_min_age_is_removed(db):
+    storage = ContentAddressedStorage()
+    name = storage.save("recipes/first.png", ContentFile(make_image()))
+    day_ago = time.time() - 24 * 60 * 60
+    os.utime(storage.path(name), (day_ago, day_ago))
+    call_command("collect_media", min_age=3600)
+    assert not storage.exists(name)
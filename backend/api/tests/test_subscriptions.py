@@ -0,0 +1,62 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from api.services import set_latest_recipes
+from recipes.models import Recipe, Subscription
+
+
+@pytest.fixture
+def timeline(make_recipe, author, user):
+    """
+    Рецепты двух авторов с разными датами публикации, от старых к новым.
+    """
+    now = timezone.now()
+    recipes = []
+    for days, recipe_author in ((5, author), (1, user), (3, author),
+                                (2, user), (0, author)):
+        recipe = make_recipe(f"Рецепт {days}", author=recipe_author)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            pub_date=now - timedelta(days=days)
+        )
+        recipes.append(recipe)
+    return recipes
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("limit", (None, 2))
+def test_latest_recipes_are_newest_first_per_author(
+    timeline, author, user, limit
+):
+    authors = set_latest_recipes([author, user], limit)
+    expected = {
+        author: [timeline[4], timeline[2], timeline[0]],
+        user: [timeline[1], timeline[3]],
+    }
+    for instance in authors:
+        assert instance.latest_recipes == expected[instance][:limit]
+
+
+@pytest.mark.django_db
+def test_subscriptions_respect_recipes_limit(
+    timeline, author, user, user_client
+):
+    Subscription.objects.create(user=user, following=author)
+    response = user_client.get(
+        "/api/users/subscriptions/", {"recipes_limit": 2}
+    )
+    assert response.status_code == 200
+    data, = response.json()["results"]
+    assert [recipe["id"] for recipe in data["recipes"]] == [
+        timeline[4].pk, timeline[2].pk
+    ]
+    assert data["recipes_count"] == 3
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("params", ({}, {"recipes_limit": 3}))
+def test_subscriptions_without_authors(user_client, params):
+    response = user_client.get("/api/users/subscriptions/", params)
+    assert response.status_code == 200
+    assert response.json()["results"] == []
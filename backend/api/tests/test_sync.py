@@ -0,0 +1,72 @@
+import pytest
+
+from api import services
+from recipes.models import Recipe, User, UserFavoriteRecipes, UserShoppingCart
+
+from .test_shopping_lists import assert_consistent
+
+
+def sync(client, *operations):
+    response = client.post(
+        "/api/sync/",
+        {
+            "operations": [
+                {"type": kind, "action": action, "id": pk}
+                for kind, action, pk in operations
+            ]
+        },
+        format="json",
+    )
+    assert response.status_code == 200
+    return [result["status"] for result in response.json()["results"]]
+
+
+@pytest.mark.django_db
+def test_sync_counts_added_relations(
+    vendor, make_recipe, author, user_client
+):
+    recipes = [make_recipe(f"Рецепт {number}") for number in range(2)]
+    statuses = sync(
+        user_client,
+        *(("favorite", "add", recipe.pk) for recipe in recipes),
+        *(("shopping_cart", "add", recipe.pk) for recipe in recipes),
+        ("subscribe", "add", author.pk),
+        ("favorite", "remove", recipes[0].pk),
+        ("subscribe", "add", 404404),
+    )
+    assert statuses == [201, 201, 201, 201, 201, 204, 404]
+    assert list(
+        Recipe.objects.order_by("id")
+        .values_list("favorites_count", "cart_count")
+    ) == [(0, 1), (1, 1)]
+    assert User.objects.get(pk=author.pk).followers_count == 1
+    assert_consistent()
+
+
+@pytest.mark.django_db
+def test_sync_skips_relations_added_concurrently(
+    vendor, make_recipe, user, user_client, monkeypatch
+):
+    """
+    Связи, которые параллельный запрос добавил после чтения состояния,
+    не увеличивают счётчики и списки покупок второй раз.
+    """
+    recipe = make_recipe()
+    get_user_flags = services.get_user_flags
+
+    def stale_flags(*args):
+        flags = get_user_flags(*args)
+        UserFavoriteRecipes.objects.create(user=user, recipe=recipe)
+        UserShoppingCart.objects.create(user=user, recipe=recipe)
+        return flags
+
+    monkeypatch.setattr(services, "get_user_flags", stale_flags)
+    statuses = sync(
+        user_client,
+        ("favorite", "add", recipe.pk),
+        ("shopping_cart", "add", recipe.pk),
+    )
+    assert statuses == [201, 201]
+    recipe.refresh_from_db()
+    assert (recipe.favorites_count, recipe.cart_count) == (1, 1)
+    assert_consistent()
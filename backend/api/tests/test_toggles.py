@@ -0,0 +1,124 @@
+import pytest
+from django.db import connection
+
+from recipes.models import (Recipe, Subscription, User, UserFavoriteRecipes,
+                            UserShoppingCart)
+
+RECIPE_TOGGLES = (
+    ("favorite", UserFavoriteRecipes, "favorites_count"),
+    ("shopping_cart", UserShoppingCart, "cart_count"),
+)
+
+
+@pytest.fixture(autouse=True)
+def postgresql():
+    """
+    Переключатели на SQL-запросах с RETURNING работают только на PostgreSQL.
+    """
+    if connection.vendor != "postgresql":
+        pytest.skip("нужен PostgreSQL")
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("action, model_cls, counter", RECIPE_TOGGLES)
+def test_recipe_toggle(
+    action, model_cls, counter, make_recipe, user, user_client,
+    django_assert_max_num_queries,
+):
+    recipe = make_recipe()
+    url = f"/api/recipes/{recipe.pk}/{action}/"
+    with django_assert_max_num_queries(2):
+        response = user_client.post(url)
+    assert response.status_code == 201
+    assert response.json() == {
+        "id": recipe.pk,
+        "name": recipe.name,
+        "image": recipe.image.url,
+        "image_variants": response.json()["image_variants"],
+        "cooking_time": recipe.cooking_time,
+    }
+    assert model_cls.objects.filter(user=user, recipe=recipe).exists()
+    assert getattr(Recipe.objects.get(pk=recipe.pk), counter) == 1
+
+    with django_assert_max_num_queries(2):
+        response = user_client.post(url)
+    assert response.status_code == 400
+    assert getattr(Recipe.objects.get(pk=recipe.pk), counter) == 1
+
+    with django_assert_max_num_queries(2):
+        response = user_client.delete(url)
+    assert response.status_code == 204
+    assert not model_cls.objects.filter(user=user, recipe=recipe).exists()
+    assert getattr(Recipe.objects.get(pk=recipe.pk), counter) == 0
+
+    with django_assert_max_num_queries(2):
+        response = user_client.delete(url)
+    assert response.status_code == 400
+    assert getattr(Recipe.objects.get(pk=recipe.pk), counter) == 0
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("action", ("favorite", "shopping_cart"))
+@pytest.mark.parametrize("method", ("post", "delete"))
+def test_recipe_toggle_missing_recipe(
+    action, method, user_client, django_assert_max_num_queries
+):
+    with django_assert_max_num_queries(2):
+        response = getattr(user_client, method)(
+            f"/api/recipes/404404/{action}/"
+        )
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_subscribe_toggle(
+    make_recipe, author, user, user_client, django_assert_max_num_queries
+):
+    recipes = [make_recipe(f"Рецепт {number}") for number in range(3)]
+    url = f"/api/users/{author.pk}/subscribe/?recipes_limit=2"
+    with django_assert_max_num_queries(2):
+        response = user_client.post(url)
+    assert response.status_code == 201
+    data = response.json()
+    assert data["id"] == author.pk
+    assert data["is_subscribed"] is True
+    assert data["recipes_count"] == len(recipes)
+    assert [recipe["id"] for recipe in data["recipes"]] == [
+        recipe.pk for recipe in reversed(recipes[1:])
+    ]
+    assert User.objects.get(pk=author.pk).followers_count == 1
+
+    with django_assert_max_num_queries(2):
+        response = user_client.post(url)
+    assert response.status_code == 400
+
+    with django_assert_max_num_queries(2):
+        response = user_client.delete(url)
+    assert response.status_code == 204
+    assert not Subscription.objects.filter(
+        user=user, following=author
+    ).exists()
+    assert User.objects.get(pk=author.pk).followers_count == 0
+
+    with django_assert_max_num_queries(2):
+        response = user_client.delete(url)
+    assert response.status_code == 400
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("method", ("post", "delete"))
+def test_subscribe_missing_user(
+    method, user_client, django_assert_max_num_queries
+):
+    with django_assert_max_num_queries(2):
+        response = getattr(user_client, method)(
+            "/api/users/404404/subscribe/"
+        )
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_subscribe_to_self(user, user_client, django_assert_num_queries):
+    with django_assert_num_queries(0):
+        response = user_client.post(f"/api/users/{user.pk}/subscribe/")
+    assert response.status_code == 400
@@ -0,0 +1,75 @@
+import base64
+
+import pytest
+from rest_framework.exceptions import ValidationError
+
+from api.utils import Base64ImageField, DecodedImageFile
+
+from .conftest import make_image
+
+
+def data_url(content, line_length=None):
+    encoded = base64.b64encode(content).decode()
+    if line_length:
+        encoded = "\r\n".join(
+            encoded[start:start + line_length]
+            for start in range(0, len(encoded), line_length)
+        )
+    return f"data:image/png;base64,{encoded}"
+
+
+@pytest.fixture
+def closed_files(monkeypatch):
+    closed = []
+    close = DecodedImageFile.close
+
+    def tracked(upload):
+        closed.append(upload)
+        return close(upload)
+
+    monkeypatch.setattr(DecodedImageFile, "close", tracked)
+    return closed
+
+
+@pytest.mark.parametrize("line_length", (None, 76, 75))
+@pytest.mark.parametrize("chunk_size", (7, 64, 64 * 1024))
+def test_base64_decodes_across_chunks_and_line_breaks(
+    monkeypatch, line_length, chunk_size
+):
+    monkeypatch.setattr("api.utils.IMAGE_DECODE_CHUNK_SIZE", chunk_size)
+    content = make_image((300, 200))
+    image = Base64ImageField().to_internal_value(
+        data_url(content, line_length)
+    )
+    try:
+        assert image.read() == content
+        assert image.size == len(content)
+    finally:
+        image.close()
+
+
+@pytest.mark.parametrize("tail", ("A", "=", "*"))
+def test_invalid_base64_is_rejected(closed_files, tail):
+    with pytest.raises(ValidationError):
+        Base64ImageField().to_internal_value(data_url(make_image()) + tail)
+
+
+def test_oversized_image_is_rejected_before_decoding(settings, closed_files):
+    settings.IMAGE_UPLOAD_MAX_DIMENSION = 100
+    with pytest.raises(ValidationError) as error:
+        Base64ImageField().to_internal_value(data_url(make_image((120, 40))))
+    assert "пикселей" in str(error.value)
+    assert closed_files == []
+
+
+@pytest.mark.django_db
+def test_decoded_avatar_is_closed_after_save(user, user_client, closed_files):
+    response = user_client.put(
+        "/api/users/me/avatar/",
+        {"avatar": data_url(make_image())},
+        format="json",
+    )
+    assert response.status_code == 200
+    assert len(closed_files) == 1
+    user.refresh_from_db()
+    assert user.avatar.read() == make_image()
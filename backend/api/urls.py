@@ -1,8 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import SimpleRouter
 
-from .views import (IngredientsViewSet, get_recipe,
-                    RecipeViewSet, TagViewSet, UserViewSet)
+from .views import (IngredientsViewSet, cache_stats, get_recipe,
+                    RecipeViewSet, sync, TagViewSet, UserViewSet)
 
 router = SimpleRouter()
 router.register(r"ingredients", IngredientsViewSet, basename="ingredients")
@@ -13,5 +13,7 @@ router.register(r"users", UserViewSet, basename="users")
 urlpatterns = [
     path("", include(router.urls)),
     path("s/<str:short_link>/", get_recipe),
+    path("sync/", sync),
+    path("cache-stats/", cache_stats),
     path("auth/", include("djoser.urls.authtoken")),
 ]
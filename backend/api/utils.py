@@ -1,22 +1,155 @@
 import base64
-from random import choice
+import binascii
+from io import BytesIO
 from string import ascii_letters, digits
 
-from django.core.files.base import ContentFile
-from django_filters import FilterSet, ModelMultipleChoiceFilter, NumberFilter
-from rest_framework import filters, serializers
-from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from django_filters import (CharFilter, FilterSet, MultipleChoiceFilter,
+                            NumberFilter)
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (Cursor, CursorPagination,
+                                       PageNumberPagination)
+from rest_framework.parsers import FileUploadParser
 
-from recipes.models import Recipe, ShortLink, Tag
+from recipes.models import SEARCH_CONFIG, Recipe, ShortLink
+from .dictionaries import known_tags
+
+IMAGE_DECODE_CHUNK_SIZE = 64 * 1024
+
+
+class DecodedImageFile(TemporaryUploadedFile):
+    """
+    Временный файл изображения, декодированного из base64. В отличие от
+    загрузок из request.FILES его не закрывает обработчик запроса, поэтому
+    после сохранения его закрывает close_decoded_images.
+    """
+
+
+def close_decoded_images(data):
+    """
+    Закрывает временные файлы изображений из base64 в проверенных данных.
+    """
+    for value in data.values():
+        if isinstance(value, DecodedImageFile):
+            value.close()
 
 
 class Base64ImageField(serializers.ImageField):
+    """
+    Изображение из data URL в base64 или из загруженного файла.
+    Размер и габариты проверяются до полного декодирования, base64
+    декодируется частями во временный файл на диске.
+    """
+    default_error_messages = {
+        "too_large": "Размер изображения больше {max_size} байт.",
+        "too_big": "Сторона изображения больше {max_dimension} пикселей.",
+    }
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith("data:image"):
-            format, imgstr = data.split(";base64,")
-            ext = format.split("/")[-1]
-            data = ContentFile(base64.b64decode(imgstr), name="temp." + ext)
-        return super().to_internal_value(data)
+            data = self.__decode(data)
+        elif hasattr(data, "size"):
+            self.__check_size(data.size)
+            self.__check_dimensions(data)
+        try:
+            image = super().to_internal_value(data)
+            if getattr(image, "image", None) is not None:
+                self.__check_dimensions(image.image)
+        except serializers.ValidationError:
+            if isinstance(data, DecodedImageFile):
+                data.close()
+            raise
+        return image
+
+    def __decode(self, data):
+        # Строка base64 не копируется: части читаются прямо из data.
+        start = data.find(";base64,")
+        if start < 0:
+            self.fail("invalid_image")
+        ext = data[:start].split("/")[-1]
+        start += len(";base64,")
+        self.__check_size((len(data) - start) * 3 // 4)
+        chunks = self.__decode_chunks(data, start)
+        head = next(chunks, b"")
+        self.__check_dimensions(BytesIO(head))
+        upload = DecodedImageFile(
+            "temp." + ext, f"image/{ext}", None, None
+        )
+        try:
+            upload.write(head)
+            for chunk in chunks:
+                upload.write(chunk)
+        except serializers.ValidationError:
+            upload.close()
+            raise
+        upload.size = upload.tell()
+        upload.seek(0)
+        return upload
+
+    def __decode_chunks(self, data, start):
+        """
+        Декодирует base64 из data начиная с start частями. Пробелы и
+        переводы строк отбрасываются, а хвост части, не кратный 4 символам,
+        переносится в следующую.
+        """
+        rest = ""
+        for start in range(start, len(data), IMAGE_DECODE_CHUNK_SIZE):
+            chunk = rest + "".join(
+                data[start:start + IMAGE_DECODE_CHUNK_SIZE].split()
+            )
+            end = len(chunk) - len(chunk) % 4
+            rest = chunk[end:]
+            yield self.__b64decode(chunk[:end])
+        if rest:
+            self.fail("invalid_image")
+
+    def __b64decode(self, chunk):
+        try:
+            return base64.b64decode(chunk)
+        except binascii.Error:
+            self.fail("invalid_image")
+
+    def __check_size(self, size):
+        if size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.fail("too_large", max_size=settings.IMAGE_UPLOAD_MAX_SIZE)
+
+    def __check_dimensions(self, image):
+        """
+        Проверяет габариты по заголовку файла или по уже открытому
+        изображению. Нераспознанный заголовок оставляется полной проверке.
+        """
+        if not isinstance(image, Image.Image):
+            try:
+                with Image.open(image) as opened:
+                    size = opened.size
+            except (OSError, SyntaxError, ValueError):
+                return
+            finally:
+                image.seek(0)
+        else:
+            size = image.size
+        max_dimension = settings.IMAGE_UPLOAD_MAX_DIMENSION
+        if max(size) > max_dimension:
+            self.fail("too_big", max_dimension=max_dimension)
+
+
+class ImageUploadParser(FileUploadParser):
+    """
+    Принимает изображение телом запроса (Content-Type: image/*) и
+    передаёт его потоком обработчикам загрузки Django под ключом file.
+    """
+    media_type = "image/*"
+
+    def get_filename(self, stream, media_type, parser_context):
+        filename = super().get_filename(stream, media_type, parser_context)
+        return filename or f"upload.{media_type.split('/')[-1]}"
 
 
 class Pagination(PageNumberPagination):
@@ -25,37 +158,208 @@ class Pagination(PageNumberPagination):
     page_size = 6
 
 
-class SearchFilter(filters.SearchFilter):
-    search_param = "name"
+class RecipeCursorPagination(CursorPagination):
+    """
+    Курсор ленты хранит пару (pub_date, id) крайнего рецепта страницы.
+    Следующая страница выбирается условием по этой паре через индекс
+    (-pub_date, -id), поэтому рецепты с одинаковой датой не теряются и
+    не повторяются, а смещение не нужно.
+    """
+    page_size_query_param = "limit"
+    page_size = Pagination.page_size
+    ordering = ("-pub_date", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is not None and self.cursor.position is None:
+            # Пустой курсор запрашивает первую страницу.
+            self.cursor = None
+        reverse = self.cursor is not None and self.cursor.reverse
+        if self.cursor is not None:
+            pub_date, pk = self.__parse_position(self.cursor.position)
+            if reverse:
+                queryset = queryset.filter(
+                    Q(pub_date__gt=pub_date)
+                    | Q(pub_date=pub_date, id__gt=pk)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(pub_date__lt=pub_date)
+                    | Q(pub_date=pub_date, id__lt=pk)
+                )
+        queryset = queryset.order_by(
+            *(("pub_date", "id") if reverse else self.ordering)
+        )
+        results = list(queryset[:self.page_size + 1])
+        has_following = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = self.cursor is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.__get_link(self.page[-1] if self.page else None, False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.__get_link(self.page[0] if self.page else None, True)
+
+    def __get_link(self, recipe, reverse):
+        # Пустая страница (курсор за концом ленты) сохраняет свою позицию.
+        if recipe is None:
+            position = self.cursor.position
+        else:
+            position = f"{recipe.pk}:{recipe.pub_date.isoformat()}"
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=reverse, position=position)
+        )
+
+    def __parse_position(self, position):
+        pk, _, pub_date = position.partition(":")
+        try:
+            pub_date = parse_datetime(pub_date)
+        except ValueError:
+            pub_date = None
+        if not pk.isdigit() or pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return pub_date, int(pk)
+
+
+class RecipePagination(Pagination):
+    """
+    Постраничная навигация ленты рецептов. При наличии параметра cursor
+    (в том числе пустого для первой страницы) включается курсорный режим
+    без COUNT(*) и OFFSET. С поиском курсор не совмещается.
+    """
+    cursor_pagination_class = RecipeCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        cursor_param = self.cursor_pagination_class.cursor_query_param
+        if cursor_param in request.query_params:
+            if "search" in request.query_params:
+                # Результаты поиска упорядочены по релевантности, а курсор
+                # задаёт позицию только по дате и id.
+                raise serializers.ValidationError(
+                    {cursor_param: "Курсор нельзя совмещать с поиском."}
+                )
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
 
 
 class RecipeFilterSet(FilterSet):
-    is_favorited = NumberFilter(field_name="is_favorited")
-    is_in_shopping_cart = NumberFilter(field_name="is_in_shopping_cart")
+    user_relations = {
+        "is_favorited": "favorited",
+        "is_in_shopping_cart": "shopping_cart",
+    }
+
+    is_favorited = NumberFilter(method="filter_user_relation")
+    is_in_shopping_cart = NumberFilter(method="filter_user_relation")
     author = NumberFilter(field_name="author__pk")
-    tags = ModelMultipleChoiceFilter(
-        field_name="tags__slug",
-        to_field_name="slug",
-        queryset=Tag.objects.all()
+    tags = MultipleChoiceFilter(
+        method="filter_tags",
+        choices=lambda: [(slug, slug) for slug in known_tags.keys()],
     )
+    search = CharFilter(method="filter_search")
+
+    def filter_user_relation(self, queryset, name, value):
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+        lookup = {self.user_relations[name]: user}
+        if value:
+            return queryset.filter(**lookup)
+        return queryset.exclude(**lookup)
+
+    def filter_tags(self, queryset, name, value):
+        return queryset.filter(tags__in=known_tags.resolve(value)).distinct()
+
+    def filter_search(self, queryset, name, value):
+        if connection.vendor != "postgresql":
+            # icontains в SQLite не различает регистр только для ASCII,
+            # поэтому кириллица сравнивается в Python.
+            value = value.casefold()
+            return queryset.filter(pk__in=[
+                pk
+                for pk, name, text in (
+                    queryset.values_list("id", "name", "text").iterator()
+                )
+                if value in name.casefold() or value in text.casefold()
+            ])
+        query = SearchQuery(
+            value, config=SEARCH_CONFIG, search_type="websearch"
+        )
+        return (
+            queryset
+            .filter(search_vector=query)
+            .annotate(rank=SearchRank(F("search_vector"), query))
+            .order_by("-rank", "-pub_date", "-id")
+        )
 
     class Meta:
         model = Recipe
         fields = ("author", "is_favorited", "is_in_shopping_cart")
 
 
-def get_or_create_short_link(recipe_id):
-    try:
-        return ShortLink.objects.get(recipe_id=recipe_id).link
-    except ShortLink.DoesNotExist:
-        chars = ascii_letters + digits
-        links = list(ShortLink.objects.values("link"))
-        link = __create_random_link(chars)
-        while link in links:
-            link = __create_random_link(chars)
-        ShortLink.objects.create(recipe_id=recipe_id, link=link)
-        return link
+def get_positive_int(value, default=None):
+    return int(value) if value and value.isdigit() else default
+
+
+SHORT_LINK_ALPHABET = digits + ascii_letters
+SHORT_LINK_LENGTH = 8
+SHORT_LINK_SPACE = len(SHORT_LINK_ALPHABET) ** SHORT_LINK_LENGTH
+# Множитель взаимно прост с SHORT_LINK_SPACE (не делится на 2 и 31),
+# поэтому id -> код — биекция на [0, SHORT_LINK_SPACE).
+SHORT_LINK_MULTIPLIER = 134_893_210_947_191
+SHORT_LINK_OFFSET = 93_563_123_871
+
+
+def encode_short_link(recipe_id):
+    """
+    Код короткой ссылки рецепта: перемешанный id в base62 фиксированной
+    длины. Разные рецепты всегда получают разные коды, поэтому проверка
+    на совпадения не нужна.
+    """
+    number = (
+        recipe_id * SHORT_LINK_MULTIPLIER + SHORT_LINK_OFFSET
+    ) % SHORT_LINK_SPACE
+    chars = []
+    for _ in range(SHORT_LINK_LENGTH):
+        number, index = divmod(number, len(SHORT_LINK_ALPHABET))
+        chars.append(SHORT_LINK_ALPHABET[index])
+    return "".join(reversed(chars))
 
 
-def __create_random_link(chars):
-    return "".join([choice(chars) for _ in range(5)])
+def get_or_create_short_link(recipe_id):
+    link = (
+        ShortLink.objects.filter(recipe_id=recipe_id)
+        .values_list("link", flat=True)
+        .first()
+    )
+    if link is not None:
+        return link
+    link = encode_short_link(recipe_id)
+    try:
+        with transaction.atomic():
+            ShortLink.objects.create(recipe_id=recipe_id, link=link)
+    except IntegrityError:
+        # Ссылку уже создал параллельный запрос.
+        pass
+    return link
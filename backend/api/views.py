@@ -1,51 +1,116 @@
-from io import BytesIO
-
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http.response import FileResponse
+from django.http import (Http404, HttpResponseRedirect,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.serializers import SetPasswordSerializer, UserCreateSerializer
 from rest_framework import mixins, status, viewsets
-from rest_framework.decorators import action, api_view
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.parsers import JSONParser, MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 
+from .cache import (cache_anonymous_response, get_recipe_bodies, get_stats,
+                    recipe_detail_key, recipe_list_key, resolve_short_link)
+from .dictionaries import (ingredient_index, ingredients_snapshot,
+                           tags_snapshot)
+from .exports import SHOPPING_LIST_RENDERERS, FormatNegotiation
+from .imports import NDJSONParser, import_recipes
+from .pantry import pantry_index
 from .permissions import IsAuthorOrReadOnly
-from recipes.models import (Ingredient, Recipe, ShortLink, Subscription,
-                            Tag, UserFavoriteRecipes, UserShoppingCart)
+from recipes.models import (Ingredient, Recipe, ShortLink, Tag,
+                            UserFavoriteRecipes, UserShoppingCart)
 from .serializers import (IngredientSerializer, RecipeMinifiedSerializer,
-                          RecipeSerializer, TagSerializer, UserSerializer,
-                          UserSetAvatarSerializer, UserWithRecipesSerializer)
-from .services import get_shopping_list
-from .utils import (Pagination, RecipeFilterSet, SearchFilter,
-                    get_or_create_short_link)
+                          RecipeSerializer, SyncSerializer, TagSerializer,
+                          UserSerializer, UserSetAvatarSerializer,
+                          UserWithRecipesSerializer)
+from .services import (add_recipe_relation, add_subscription,
+                       apply_user_flags, get_shopping_list_etag,
+                       get_shopping_list_rows, get_shopping_list_title,
+                       remove_recipe_relation, remove_subscription,
+                       set_latest_recipes, set_user_flags,
+                       sync_user_relations)
+from .utils import (ImageUploadParser, Pagination, RecipeFilterSet,
+                    RecipePagination, get_or_create_short_link,
+                    get_positive_int)
 
 User = get_user_model()
 
+PANTRY_MAX_RESULTS = 100
+
+
+class DictionaryMixin:
+    """
+    Отдаёт список справочника из готового снимка с поддержкой ETag.
+    Постраничный вывод включается параметрами page или limit.
+    """
+    snapshot = None
+
+    def list(self, request, *args, **kwargs):
+        if not {"page", "limit"} & set(request.query_params):
+            return self.snapshot.response(request)
+        paginator = Pagination()
+        page = paginator.paginate_queryset(
+            self.snapshot.refresh().items, request, self
+        )
+        return paginator.get_paginated_response(page)
+
 
-class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientsViewSet(DictionaryMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (SearchFilter,)
-    search_fields = ("^name",)
+    snapshot = ingredients_snapshot
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get("name")
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        limit = get_positive_int(request.query_params.get("limit"))
+        return Response(ingredient_index.search(name, limit))
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(DictionaryMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
+    snapshot = tags_snapshot
 
 
 class RecipeViewSet(viewsets.ModelViewSet):
     serializer_class = RecipeSerializer
-    pagination_class = Pagination
+    pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilterSet
 
-    def get_queryset(self):
-        return Recipe.detailed.annotate_extra_info(self.request.user).order_by(
-            "-pub_date"
+    @cache_anonymous_response(recipe_list_key)
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(
+            serialize_recipes(request, [recipe.pk for recipe in page])
         )
 
+    @cache_anonymous_response(recipe_detail_key)
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs["pk"]
+        data = serialize_recipes(request, [int(pk)] if pk.isdigit() else [])
+        if not data:
+            raise Http404
+        return Response(data[0])
+
+    def get_queryset(self):
+        if self.action == "list":
+            return Recipe.objects.only("id", "pub_date").order_by(
+                "-pub_date", "-id"
+            )
+        return Recipe.detailed.with_details().order_by("-pub_date", "-id")
+
+    def get_object(self):
+        recipe = super().get_object()
+        set_user_flags((recipe,), self.request.user)
+        return recipe
+
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
@@ -65,51 +130,116 @@ class RecipeViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=["post", "delete"])
     def favorite(self, request, *args, **kwargs):
         return self.__handle_favorites_shopping_cart(
-            request, kwargs["pk"], UserFavoriteRecipes, "избранных"
+            request,
+            kwargs["pk"],
+            UserFavoriteRecipes,
+            "favorites_count",
+            "избранных",
         )
 
     @action(detail=True, methods=["post", "delete"])
     def shopping_cart(self, request, *args, **kwargs):
         return self.__handle_favorites_shopping_cart(
-            request, kwargs["pk"], UserShoppingCart, "корзине"
+            request, kwargs["pk"], UserShoppingCart, "cart_count", "корзине"
         )
 
     @action(detail=True, url_path="get-link", methods=["get"])
     def get_link(self, request, *args, **kwargs):
-        get_object_or_404(Recipe, pk=kwargs["pk"])
-        link = get_or_create_short_link(kwargs["pk"])
+        recipe = get_object_or_404(Recipe.objects.only("id"), pk=kwargs["pk"])
+        link = get_or_create_short_link(recipe.pk)
         link = f'{request.META["HTTP_HOST"]}/s/{link}'
         return Response(status=status.HTTP_200_OK, data={"short-link": link})
 
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="import",
+        parser_classes=(NDJSONParser,),
+        permission_classes=(IsAuthenticated,),
+    )
+    def bulk_import(self, request, *args, **kwargs):
+        report = import_recipes(request.data, request.user)
+        return Response(status=status.HTTP_200_OK, data=report)
+
     @action(detail=False, methods=["get"])
+    def pantry(self, request, *args, **kwargs):
+        ingredient_ids = [
+            int(pk)
+            for pk in request.query_params.getlist("ingredients")
+            if pk.isdigit()
+        ]
+        limit = min(
+            get_positive_int(
+                request.query_params.get("limit"), Pagination.page_size
+            ),
+            PANTRY_MAX_RESULTS,
+        )
+        matches = pantry_index.match(ingredient_ids, limit)
+        recipes = Recipe.objects.in_bulk(
+            [recipe_id for recipe_id, _, _ in matches]
+        )
+        return Response(
+            [
+                {
+                    **RecipeMinifiedSerializer(recipes[recipe_id]).data,
+                    "matched_ingredients": matched,
+                    "total_ingredients": total,
+                }
+                for recipe_id, matched, total in matches
+                if recipe_id in recipes
+            ]
+        )
+
+    @action(
+        detail=False,
+        methods=["get"],
+        renderer_classes=SHOPPING_LIST_RENDERERS,
+        content_negotiation_class=FormatNegotiation,
+    )
     def download_shopping_cart(self, request, *args, **kwargs):
-        shopping_list = get_shopping_list(request.user)
-        return FileResponse(
-            BytesIO(shopping_list.encode('utf-8')),
-            as_attachment=True,
-            filename='shopping_list.txt'
+        renderer = request.accepted_renderer
+        etag = get_shopping_list_etag(request.user, renderer.format)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
+        response = StreamingHttpResponse(
+            renderer.stream(
+                get_shopping_list_title(request.user),
+                get_shopping_list_rows(request.user),
+            ),
+            content_type=f"{renderer.media_type}; charset={renderer.charset}",
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
         )
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
 
-    def __handle_favorites_shopping_cart(self, request, pk, model_cls, target):
-        recipe = get_object_or_404(Recipe, pk=pk)
+    def __handle_favorites_shopping_cart(
+        self, request, pk, model_cls, counter, target
+    ):
+        recipe_id = get_positive_int(pk)
+        if recipe_id is None:
+            raise Http404
         if request.method == "DELETE":
-            try:
-                to_delete = model_cls.objects.get(
-                    user=request.user,
-                    recipe=recipe
-                )
-                to_delete.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            except model_cls.DoesNotExist:
+            found, deleted = remove_recipe_relation(
+                model_cls, counter, request.user, recipe_id
+            )
+            if not found:
+                raise Http404
+            if not deleted:
                 return Response(
                     status=status.HTTP_400_BAD_REQUEST,
                     data=f"Данный рецепт не был в {target}",
                 )
+            return Response(status=status.HTTP_204_NO_CONTENT)
 
-        _, created = model_cls.objects.get_or_create(
-            user=request.user,
-            recipe=recipe
+        recipe, created = add_recipe_relation(
+            model_cls, counter, request.user, recipe_id
         )
+        if recipe is None:
+            raise Http404
         if not created:
             return Response(
                 status=status.HTTP_400_BAD_REQUEST,
@@ -143,11 +273,12 @@ class UserViewSet(
 
     def get_queryset(self):
         if self.action in ["subscriptions", "subscribe"]:
-            return User.detailed.subscribed_with_recipes(
-                self.request.user
-            ).all()
+            return User.detailed.subscribed(self.request.user).all()
         return User.detailed.is_subscribed(self.request.user).all()
 
+    def get_recipes_limit(self):
+        return get_positive_int(self.request.query_params.get("recipes_limit"))
+
     @action(detail=False, methods=["get"])
     def me(self, request):
         user = self.get_queryset().get(id=request.user.id)
@@ -159,17 +290,25 @@ class UserViewSet(
         serializer = SetPasswordSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         self.request.user.set_password(serializer.data["new_password"])
-        self.request.user.save()
+        self.request.user.save(update_fields=("password",))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=False, url_path="me/avatar", methods=["put", "delete"])
+    @action(
+        detail=False,
+        url_path="me/avatar",
+        methods=["put", "delete"],
+        parser_classes=(JSONParser, MultiPartParser, ImageUploadParser),
+    )
     def avatar(self, request, *args, **kwargs):
         if request.method == "DELETE":
             request.user.avatar = None
             request.user.save()
             return Response(status=status.HTTP_204_NO_CONTENT)
+        data = request.data
+        if "file" in request.FILES:
+            data = {"avatar": request.FILES["file"]}
         serializer = UserSetAvatarSerializer(
-            data=request.data,
+            data=data,
             instance=request.user
         )
         serializer.is_valid(raise_exception=True)
@@ -181,10 +320,12 @@ class UserViewSet(
         queryset = self.get_queryset()
         page = self.paginate_queryset(queryset)
         if page is not None:
+            set_latest_recipes(page, self.get_recipes_limit())
             serializer = UserWithRecipesSerializer(
                 page, many=True, context={"request": request}
             )
             return self.get_paginated_response(serializer.data)
+        queryset = set_latest_recipes(list(queryset), self.get_recipes_limit())
         serializer = UserWithRecipesSerializer(
             queryset, many=True, context={"request": request}
         )
@@ -192,33 +333,33 @@ class UserViewSet(
 
     @action(detail=True, methods=["post", "delete"])
     def subscribe(self, request, *args, **kwargs):
-        following = get_object_or_404(User, pk=kwargs["pk"])
+        following_id = get_positive_int(kwargs["pk"])
+        if following_id is None:
+            raise Http404
         if request.method == "DELETE":
-            try:
-                following = Subscription.objects.get(
-                    user=request.user, following=following
-                )
-                following.delete()
-                return Response(status=status.HTTP_204_NO_CONTENT)
-            except Subscription.DoesNotExist:
+            found, deleted = remove_subscription(request.user, following_id)
+            if not found:
+                raise Http404
+            if not deleted:
                 return Response(
                     status=status.HTTP_400_BAD_REQUEST,
                     data="Нет подписки на данного пользователя",
                 )
-        if following == request.user:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        if following_id == request.user.pk:
             return Response(
                 status=status.HTTP_400_BAD_REQUEST,
                 data="Подписка на себя запрещена"
             )
-        _, created = Subscription.objects.get_or_create(
-            user=request.user, following=following
-        )
+        following, created = add_subscription(request.user, following_id)
+        if following is None:
+            raise Http404
         if not created:
             return Response(
                 status=status.HTTP_400_BAD_REQUEST,
                 data="Вы уже подписаны на этго пользователя",
             )
-        following = self.get_queryset().get(pk=following.pk)
+        set_latest_recipes((following,), self.get_recipes_limit())
         return Response(
             status=status.HTTP_201_CREATED,
             data=UserWithRecipesSerializer(
@@ -227,13 +368,60 @@ class UserViewSet(
         )
 
 
+def serialize_recipes(request, pks):
+    """
+    Собирает представления рецептов в порядке pks из общего кэша и
+    накладывает флаги текущего пользователя. Несуществующие рецепты
+    пропускаются.
+    """
+    def build(missing):
+        recipes = Recipe.detailed.with_details().filter(pk__in=missing)
+        return {
+            recipe.pk: RecipeSerializer(
+                recipe, context={"request": request}
+            ).data
+            for recipe in recipes
+        }
+
+    bodies = get_recipe_bodies(pks, build)
+    return apply_user_flags(
+        [bodies[pk] for pk in pks if pk in bodies], request.user
+    )
+
+
+def __find_short_link(link):
+    return (
+        ShortLink.objects.filter(link=link)
+        .values_list("recipe_id", flat=True)
+        .first()
+    )
+
+
 @api_view(['GET'])
 def get_recipe(request, short_link):
-    link = get_object_or_404(ShortLink, link=short_link)
-    recipe = (Recipe
-              .detailed
-              .annotate_extra_info(request.user)
-              .get(pk=link.recipe.id))
-    return Response(
-        status=status.HTTP_200_OK,
-        data=RecipeSerializer(recipe, context={"request": request}).data)
+    recipe_id = resolve_short_link(short_link, __find_short_link)
+    if recipe_id is None:
+        raise Http404
+    if settings.SHORT_LINK_REDIRECT or "redirect" in request.query_params:
+        return HttpResponseRedirect(f"/recipes/{recipe_id}")
+    recipes = serialize_recipes(request, [recipe_id])
+    if not recipes:
+        raise Http404
+    return Response(status=status.HTTP_200_OK, data=recipes[0])
+
+
+@api_view(['POST'])
+@permission_classes((IsAuthenticated,))
+def sync(request):
+    serializer = SyncSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    results = sync_user_relations(
+        request.user, serializer.validated_data["operations"]
+    )
+    return Response(status=status.HTTP_200_OK, data={"results": results})
+
+
+@api_view(['GET'])
+@permission_classes((IsAdminUser,))
+def cache_stats(request):
+    return Response(status=status.HTTP_200_OK, data=get_stats())
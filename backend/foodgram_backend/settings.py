@@ -80,6 +80,25 @@ DATABASES = {
     }
 }
 
+# Версии в кэше сообщают об изменениях всем процессам (воркерам и
+# командам manage.py), поэтому кэш по умолчанию общий — файловый.
+# locmem годится только для одного процесса.
+CACHE_BACKENDS = {
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+}
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "file")
+CACHES = {
+    "default": {
+        "BACKEND": CACHE_BACKENDS.get(CACHE_BACKEND, CACHE_BACKEND),
+        "LOCATION": os.getenv("CACHE_LOCATION", "/tmp/foodgram_cache"),
+        "TIMEOUT": env.int("CACHE_TIMEOUT", 300),
+    }
+}
+
+# Короткие ссылки отвечают редиректом на страницу рецепта вместо JSON.
+SHORT_LINK_REDIRECT = env.bool("SHORT_LINK_REDIRECT", False)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -112,6 +131,15 @@ STATIC_ROOT = BASE_DIR / "collected_static"
 MEDIA_URL = "/media/"
 MEDIA_FILES_DIR = BASE_DIR / "media"
 MEDIA_ROOT = BASE_DIR / "media"
+DEFAULT_FILE_STORAGE = "api.storage.ContentAddressedStorage"
+
+IMAGE_UPLOAD_MAX_SIZE = env.int("IMAGE_UPLOAD_MAX_SIZE", 10 * 1024 * 1024)
+IMAGE_UPLOAD_MAX_DIMENSION = env.int("IMAGE_UPLOAD_MAX_DIMENSION", 6000)
+IMAGE_VARIANT_WORKERS = env.int("IMAGE_VARIANT_WORKERS", 2)
+# Загрузки больше этого размера пишутся во временный файл, а не в память.
+FILE_UPLOAD_MAX_MEMORY_SIZE = env.int(
+    "FILE_UPLOAD_MAX_MEMORY_SIZE", 512 * 1024
+)
 
 SEEDDATA_DIR = BASE_DIR / "static/data"
 SEED_USERS_PASSWORD = os.getenv("SEED_USERS_PASSWORD", "realystrongpassword1352")
@@ -0,0 +1,59 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand
+
+from api.cache import invalidate_recipes
+from api.images import build_variants, mark_variants_built
+from recipes.models import Recipe
+
+User = get_user_model()
+
+MARK_CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Builds resized variants of recipe images and avatars"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force", action="store_true", help="Rebuild existing variants"
+        )
+
+    def handle(self, *args, **options):
+        names = set(
+            Recipe.objects.exclude(image="").exclude(image=None)
+            .values_list("image", flat=True)
+        ) | set(
+            User.objects.exclude(avatar="").exclude(avatar=None)
+            .values_list("avatar", flat=True)
+        )
+        with ThreadPoolExecutor(settings.IMAGE_VARIANT_WORKERS) as executor:
+            futures = {
+                name: executor.submit(self.build, name, options["force"])
+                for name in sorted(names)
+            }
+        written = failed = 0
+        built = []
+        for name, future in futures.items():
+            result = future.result()
+            if result is None:
+                failed += 1
+            else:
+                written += result
+                built.append(name)
+        for start in range(0, len(built), MARK_CHUNK_SIZE):
+            mark_variants_built(built[start:start + MARK_CHUNK_SIZE])
+        invalidate_recipes()
+        print(f"Images: {len(names)}")
+        print(f"Variants written: {written}")
+        print(f"Images failed: {failed}")
+
+    def build(self, name, force):
+        try:
+            return build_variants(name, default_storage, force)
+        except Exception as ex:
+            print(f"Unable to build variants for {name}. Error: {repr(ex)}")
+            return None
@@ -0,0 +1,70 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import F, Sum
+
+from recipes.models import ShoppingListItem, UserShoppingCart
+
+
+class Command(BaseCommand):
+    help = "Checks shopping lists against the aggregated shopping carts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Rebuild shopping lists of users with mismatches",
+        )
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        expected = self.get_expected()
+        actual = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.values_list(
+                "user_id", "ingredient_id", "amount"
+            ).iterator()
+        }
+        mismatches = {
+            key for key in expected.keys() | actual.keys()
+            if expected.get(key) != actual.get(key)
+        }
+        for user_id, ingredient_id in sorted(mismatches):
+            print(
+                f"User {user_id}, ingredient {ingredient_id}: "
+                f"expected {expected.get((user_id, ingredient_id))}, "
+                f"found {actual.get((user_id, ingredient_id))}"
+            )
+        print(f"Mismatches: {len(mismatches)}")
+        if mismatches and options["fix"]:
+            self.rebuild({user_id for user_id, _ in mismatches}, expected)
+
+    def get_expected(self):
+        rows = (
+            UserShoppingCart.objects
+            .values(
+                "user_id",
+                ingredient_id=F("recipe__recipeingredient__ingredient"),
+            )
+            .filter(ingredient_id__isnull=False)
+            .annotate(amount=Sum("recipe__recipeingredient__amount"))
+            .order_by()
+        )
+        return {
+            (row["user_id"], row["ingredient_id"]): row["amount"]
+            for row in rows.iterator()
+        }
+
+    def rebuild(self, user_ids, expected):
+        ShoppingListItem.objects.filter(user_id__in=user_ids).delete()
+        ShoppingListItem.objects.bulk_create(
+            (
+                ShoppingListItem(
+                    user_id=user_id, ingredient_id=ingredient_id, amount=amount
+                )
+                for (user_id, ingredient_id), amount in expected.items()
+                if user_id in user_ids
+            ),
+            batch_size=1000,
+        )
+        print(f"Rebuilt shopping lists of {len(user_ids)} users")
@@ -0,0 +1,73 @@
+import os
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from api.images import VARIANTS_DIR, get_variant_names
+from api.storage import ContentAddressedStorage
+from recipes.models import Recipe
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Deletes media files that no recipe or user references"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Only list orphans"
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=3600,
+            help="Keep files younger than this many seconds",
+        )
+
+    def handle(self, *args, **options):
+        storage = default_storage
+        references = self.count_references()
+        shared = sum(1 for count in references.values() if count > 1)
+        print(f"Referenced files: {len(references)}, shared: {shared}")
+        keep = set(references)
+        for name in references:
+            keep.update(get_variant_names(name))
+        threshold = timezone.now() - timedelta(seconds=options["min_age"])
+        removed = freed = 0
+        for name in self.list_files(storage):
+            if name in keep or storage.get_modified_time(name) > threshold:
+                continue
+            size = storage.size(name)
+            print(f"Orphan: {name} ({size} bytes)")
+            if not options["dry_run"]:
+                storage.delete(name)
+            removed += 1
+            freed += size
+        action = "Would remove" if options["dry_run"] else "Removed"
+        print(f"{action} {removed} files, {freed} bytes")
+
+    def count_references(self):
+        references = Counter()
+        for model_cls, field in ((Recipe, "image"), (User, "avatar")):
+            references.update(
+                model_cls.objects.exclude(**{field: ""})
+                .exclude(**{f"{field}__isnull": True})
+                .values_list(field, flat=True)
+            )
+        return references
+
+    def list_files(self, storage):
+        hashed_dirs = ContentAddressedStorage.hashed_dirs
+        directories = list(hashed_dirs) + [
+            os.path.join(VARIANTS_DIR, directory) for directory in hashed_dirs
+        ]
+        for directory in directories:
+            if not storage.exists(directory):
+                continue
+            _, files = storage.listdir(directory)
+            for filename in files:
+                yield os.path.join(directory, filename)
@@ -0,0 +1,364 @@
+import csv
+import io
+import random
+from collections import Counter
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import CharField, F, Max, Sum
+from django.utils import timezone
+
+from api.cache import (PANTRY_VERSION, RECIPES_VERSION, RELATED_VERSION,
+                       bump_versions)
+from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeTag,
+                            ShoppingListItem, Subscription, Tag,
+                            UserFavoriteRecipes, UserShoppingCart)
+
+User = get_user_model()
+
+USER_FIELDS = (
+    "id",
+    "password",
+    "is_superuser",
+    "username",
+    "first_name",
+    "last_name",
+    "email",
+    "is_staff",
+    "is_active",
+    "date_joined",
+    "role",
+    "recipes_count",
+    "followers_count",
+    "built_variants",
+)
+RECIPE_FIELDS = (
+    "id",
+    "name",
+    "text",
+    "pub_date",
+    "image",
+    "cooking_time",
+    "author_id",
+    "favorites_count",
+    "cart_count",
+    "built_variants",
+)
+FIRST_NAMES = ("Анна", "Иван", "Мария", "Пётр", "Ольга", "Сергей", "Елена")
+LAST_NAMES = ("Иванов", "Смирнов", "Кузнецов", "Попов", "Соколов", "Орлов")
+DISHES = ("Салат", "Суп", "Пирог", "Рагу", "Запеканка", "Паста", "Омлет")
+
+
+class Command(BaseCommand):
+    help = "Generates a reproducible synthetic dataset for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--recipes", type=int, default=10000)
+        parser.add_argument(
+            "--author-exponent",
+            type=float,
+            default=1.2,
+            help="Power-law exponent of recipes per author",
+        )
+        parser.add_argument("--min-ingredients", type=int, default=3)
+        parser.add_argument("--max-ingredients", type=int, default=10)
+        parser.add_argument("--max-tags", type=int, default=3)
+        parser.add_argument(
+            "--favorites", type=int, default=20,
+            help="Average favorites per user",
+        )
+        parser.add_argument(
+            "--carts", type=int, default=3,
+            help="Average shopping cart recipes per user",
+        )
+        parser.add_argument(
+            "--subscriptions", type=int, default=10,
+            help="Average subscriptions per user",
+        )
+        parser.add_argument("--days", type=int, default=365)
+        parser.add_argument("--chunk-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["recipes"] < 1:
+            raise CommandError("--users and --recipes must be positive")
+        self.rng = random.Random(options["seed"])
+        self.chunk_size = options["chunk_size"]
+        self.ingredient_names = dict(
+            Ingredient.objects.values_list("id", "name")
+        )
+        self.tag_ids = sorted(Tag.objects.values_list("id", flat=True))
+        if not self.ingredient_names or not self.tag_ids:
+            raise CommandError("Ingredients and tags are required, run seed")
+        if not options["min_ingredients"] <= options["max_ingredients"]:
+            raise CommandError("--min-ingredients exceeds --max-ingredients")
+        self.images = sorted(
+            Recipe.objects.exclude(image="")
+            .filter(image__isnull=False)
+            .values_list("image", flat=True)
+            .distinct()
+        )
+        self.built_images = set(
+            Recipe.objects.filter(built_variants=F("image"))
+            .values_list("image", flat=True)
+        )
+        with transaction.atomic():
+            user_ids = self.create_users(options["users"])
+            recipe_ids, authors = self.create_recipes(user_ids, options)
+            self.create_favorites(user_ids, recipe_ids, options["favorites"])
+            self.create_carts(user_ids, recipe_ids, options["carts"])
+            self.create_subscriptions(
+                user_ids, authors, options["subscriptions"]
+            )
+            self.create_shopping_lists(user_ids)
+            Recipe.objects.filter(
+                pk__gte=recipe_ids[0], pk__lte=recipe_ids[-1]
+            ).update_search_vector()
+            call_command("recount_counters")
+        bump_versions(RECIPES_VERSION, RELATED_VERSION, PANTRY_VERSION)
+
+    def create_users(self, count):
+        print("Generating Users")
+        password = make_password(settings.SEED_USERS_PASSWORD)
+        now = timezone.now()
+        user_ids = self.allocate_ids(User, count)
+        self.insert(User, USER_FIELDS, (
+            (
+                pk,
+                password,
+                False,
+                f"user{pk}",
+                self.rng.choice(FIRST_NAMES),
+                self.rng.choice(LAST_NAMES),
+                f"user{pk}@example.com",
+                False,
+                True,
+                now,
+                "user",
+                0,
+                0,
+                "",
+            )
+            for pk in user_ids
+        ))
+        print(f"Users created: {len(user_ids)}")
+        return user_ids
+
+    def create_recipes(self, user_ids, options):
+        """
+        Авторы выбираются по степенному закону: вес автора с рангом r
+        равен r ** -exponent, ранги перемешаны относительно id.
+        """
+        print("Generating Recipes")
+        ranked = user_ids[:]
+        self.rng.shuffle(ranked)
+        weights = list(accumulate(
+            rank ** -options["author_exponent"]
+            for rank in range(1, len(ranked) + 1)
+        ))
+        authors = Counter()
+        recipe_ids = []
+        now = timezone.now()
+        ingredient_ids = sorted(self.ingredient_names)
+        left = options["recipes"]
+        while left > 0:
+            size = min(left, self.chunk_size)
+            ids = self.allocate_ids(Recipe, size)
+            recipes, recipe_ingredients, recipe_tags = [], [], []
+            for pk in ids:
+                author_id = self.rng.choices(ranked, cum_weights=weights)[0]
+                authors[author_id] += 1
+                ingredients = self.rng.sample(
+                    ingredient_ids,
+                    self.rng.randint(
+                        options["min_ingredients"],
+                        options["max_ingredients"],
+                    ),
+                )
+                name = self.ingredient_names[ingredients[0]]
+                dish = self.rng.choice(DISHES)
+                pub_date = now - timedelta(
+                    seconds=self.rng.randrange(options["days"] * 86400)
+                )
+                image = self.rng.choice(self.images) if self.images else None
+                recipes.append((
+                    pk,
+                    f"{dish}: {name} #{pk}",
+                    f"Рецепт #{pk} из "
+                    + ", ".join(self.ingredient_names[i] for i in ingredients),
+                    pub_date,
+                    image,
+                    self.rng.randint(1, 180),
+                    author_id,
+                    0,
+                    0,
+                    image if image in self.built_images else "",
+                ))
+                recipe_ingredients.extend(
+                    (pk, ingredient_id, self.rng.randint(1, 500))
+                    for ingredient_id in ingredients
+                )
+                recipe_tags.extend(
+                    (pk, tag_id)
+                    for tag_id in self.rng.sample(
+                        self.tag_ids,
+                        self.rng.randint(
+                            1, min(options["max_tags"], len(self.tag_ids))
+                        ),
+                    )
+                )
+            self.insert(Recipe, RECIPE_FIELDS, recipes)
+            self.insert(
+                RecipeIngredient,
+                ("recipe_id", "ingredient_id", "amount"),
+                recipe_ingredients,
+            )
+            self.insert(RecipeTag, ("recipe_id", "tag_id"), recipe_tags)
+            recipe_ids.extend(ids)
+            left -= size
+            print(f"Recipes created: {len(recipe_ids)}")
+        return recipe_ids, authors
+
+    def create_favorites(self, user_ids, recipe_ids, average):
+        print("Generating Favorites")
+        ranked = recipe_ids[:]
+        self.rng.shuffle(ranked)
+        weights = list(accumulate(
+            1 / rank for rank in range(1, len(ranked) + 1)
+        ))
+        rows = self.pick_for_users(
+            user_ids,
+            average,
+            lambda k: self.rng.choices(ranked, cum_weights=weights, k=k),
+        )
+        count = self.insert(
+            UserFavoriteRecipes, ("user_id", "recipe_id"), rows
+        )
+        print(f"Favorites created: {count}")
+
+    def create_carts(self, user_ids, recipe_ids, average):
+        print("Generating Shopping carts")
+        rows = self.pick_for_users(
+            user_ids,
+            average,
+            lambda k: self.rng.choices(recipe_ids, k=k),
+        )
+        count = self.insert(UserShoppingCart, ("user_id", "recipe_id"), rows)
+        print(f"Shopping carts created: {count}")
+
+    def create_subscriptions(self, user_ids, authors, average):
+        """
+        На авторов подписываются пропорционально числу их рецептов.
+        """
+        print("Generating Subscriptions")
+        author_ids = sorted(authors)
+        weights = list(accumulate(authors[pk] for pk in author_ids))
+        rows = self.pick_for_users(
+            user_ids,
+            average,
+            lambda k: self.rng.choices(author_ids, cum_weights=weights, k=k),
+            exclude_self=True,
+        )
+        count = self.insert(Subscription, ("user_id", "following_id"), rows)
+        print(f"Subscriptions created: {count}")
+
+    def create_shopping_lists(self, user_ids):
+        print("Generating Shopping lists")
+        rows = (
+            UserShoppingCart.objects
+            .filter(user_id__gte=user_ids[0], user_id__lte=user_ids[-1])
+            .values(
+                "user_id",
+                ingredient_id=F("recipe__recipeingredient__ingredient"),
+            )
+            .filter(ingredient_id__isnull=False)
+            .annotate(amount=Sum("recipe__recipeingredient__amount"))
+            .values_list("user_id", "ingredient_id", "amount")
+            .order_by()
+        )
+        count = self.insert(
+            ShoppingListItem,
+            ("user_id", "ingredient_id", "amount"),
+            rows.iterator(),
+        )
+        print(f"Shopping list items created: {count}")
+
+    def pick_for_users(self, user_ids, average, choose, exclude_self=False):
+        """
+        Для каждого пользователя выбирает в среднем average различных
+        объектов. Повторы отбрасываются, поэтому при сильном перекосе
+        весов объектов может оказаться меньше запрошенного.
+        """
+        for user_id in user_ids:
+            picked = set(choose(self.rng.randint(0, 2 * average)))
+            if exclude_self:
+                picked.discard(user_id)
+            for pk in sorted(picked):
+                yield user_id, pk
+
+    def allocate_ids(self, model_cls, count):
+        """
+        Резервирует count id заранее, чтобы связанные строки можно было
+        вставлять без обратного чтения ключей.
+        """
+        table = model_cls._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                    "FROM generate_series(1, %s)",
+                    (table, count),
+                )
+                return [pk for pk, in cursor.fetchall()]
+        start = (model_cls.objects.aggregate(pk=Max("pk"))["pk"] or 0) + 1
+        return list(range(start, start + count))
+
+    def insert(self, model_cls, fields, rows):
+        """
+        Вставляет строки пачками: в PostgreSQL через COPY, в остальных
+        базах через bulk_create. Возвращает число вставленных строк.
+        """
+        rows = iter(rows)
+        count = 0
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return count
+            if connection.vendor == "postgresql":
+                self.copy(model_cls, fields, chunk)
+            else:
+                model_cls.objects.bulk_create(
+                    model_cls(**dict(zip(fields, row))) for row in chunk
+                )
+            count += len(chunk)
+
+    def copy(self, model_cls, fields, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        quote = connection.ops.quote_name
+        fields = [model_cls._meta.get_field(field) for field in fields]
+        columns = ", ".join(quote(field.column) for field in fields)
+        # В CSV пустое значение без кавычек — NULL, а пустые строки
+        # записываются без кавычек, поэтому для строк NOT NULL это
+        # отключается явно.
+        not_null = ", ".join(
+            quote(field.column)
+            for field in fields
+            if isinstance(field, CharField) and not field.null
+        )
+        options = "FORMAT csv"
+        if not_null:
+            options += f", FORCE_NOT_NULL ({not_null})"
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert(
+                f"COPY {quote(model_cls._meta.db_table)} ({columns}) "
+                f"FROM STDIN WITH ({options})",
+                buffer,
+            )
@@ -0,0 +1,40 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+
+from api.imports import IMPORT_CHUNK_SIZE, import_recipes
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Imports recipes from an NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="NDJSON file, '-' for stdin")
+        parser.add_argument(
+            "--author", required=True, help="Author email or username"
+        )
+        parser.add_argument(
+            "--chunk-size", type=int, default=IMPORT_CHUNK_SIZE
+        )
+
+    def handle(self, *args, **options):
+        author = (
+            User.objects.filter(email=options["author"]).first()
+            or User.objects.filter(username=options["author"]).first()
+        )
+        if author is None:
+            raise CommandError(f"User {options['author']} not found")
+        if options["path"] == "-":
+            report = import_recipes(sys.stdin, author, options["chunk_size"])
+        else:
+            with open(options["path"], encoding="utf-8") as lines:
+                report = import_recipes(
+                    lines, author, options["chunk_size"]
+                )
+        for error in report["errors"]:
+            print(f"Line {error['line']}: {error['errors']}")
+        print(f"Recipes created: {len(report['created'])}")
+        print(f"Rows failed: {len(report['errors'])}")
@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import (Recipe, Subscription, UserFavoriteRecipes,
+                            UserShoppingCart)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Recomputes recipe and user engagement counters"
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        updated = Recipe.objects.update(
+            favorites_count=self.count_of(UserFavoriteRecipes, "recipe"),
+            cart_count=self.count_of(UserShoppingCart, "recipe"),
+        )
+        print(f"Recipes updated: {updated}")
+        updated = User.objects.update(
+            recipes_count=self.count_of(Recipe, "author"),
+            followers_count=self.count_of(Subscription, "following"),
+        )
+        print(f"Users updated: {updated}")
+
+    def count_of(self, model_cls, field):
+        return Coalesce(
+            Subquery(
+                model_cls.objects
+                .filter(**{field: OuterRef("pk")})
+                .order_by()
+                .values(field)
+                .annotate(count=Count("pk"))
+                .values("count"),
+                output_field=IntegerField(),
+            ),
+            0,
+        )
@@ -1,34 +1,53 @@
 import os
 from csv import DictReader
+from itertools import islice
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.management import BaseCommand
-from django.db import connection
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, call_command
+from django.db import connection, transaction
+
+from api.cache import (INGREDIENTS_VERSION, PANTRY_VERSION, RECIPES_VERSION,
+                       RELATED_VERSION, TAGS_VERSION, bump_versions)
 
 from recipes.models import (Ingredient, Recipe, RecipeIngredient, RecipeTag,
-                            ShortLink, Subscription, Tag, UserFavoriteRecipes,
-                            UserShoppingCart)
+                            ShoppingListItem, ShortLink, Subscription, Tag,
+                            UserFavoriteRecipes, UserShoppingCart)
 
 
 User = get_user_model()
 
+SEED_CHUNK_SIZE = 1000
+
 
 class Command(BaseCommand):
     help = "Loads data"
 
     def handle(self, *args, **options):
-        self.clear_database_data()
-        self.load_users()
-        self.load_ingredients()
-        self.load_tags()
-        self.load_recipes()
-        self.load_recipe_ingredients()
-        self.load_recipe_tags()
-        self.load_user_favorite_recipes()
-        self.load_user_shopping_cart()
-        self.load_subscriptions()
-        self.update_intial_ids()
+        with transaction.atomic():
+            self.clear_database_data()
+            self.load_users()
+            self.load_ingredients()
+            self.load_tags()
+            self.load_recipes()
+            self.load_recipe_ingredients()
+            self.load_recipe_tags()
+            self.load_user_favorite_recipes()
+            self.load_user_shopping_cart()
+            self.load_subscriptions()
+            self.update_intial_ids()
+            Recipe.objects.update_search_vector()
+        bump_versions(
+            RECIPES_VERSION,
+            RELATED_VERSION,
+            INGREDIENTS_VERSION,
+            TAGS_VERSION,
+            PANTRY_VERSION,
+        )
+        call_command("recount_counters")
+        call_command("check_shopping_lists", fix=True)
+        call_command("build_image_variants")
 
     def clear_database_data(self):
         models_to_clear = [
@@ -37,20 +56,38 @@ class Command(BaseCommand):
             Recipe,
             RecipeIngredient,
             RecipeTag,
+            ShoppingListItem,
             ShortLink,
             Subscription,
             Tag,
             UserFavoriteRecipes,
             UserShoppingCart,
         ]
-        for model_class in models_to_clear:
-            model_class.objects.all().delete()
-
-    def try_save(self, obj, name):
-        try:
-            obj.save()
-        except Exception as ex:
-            print(f"Unable to load object {name}. Error: {repr(ex)}")
+        if connection.vendor != "postgresql":
+            for model_class in models_to_clear:
+                model_class.objects.all().delete()
+            return
+        tables = ", ".join(
+            connection.ops.quote_name(model_class._meta.db_table)
+            for model_class in models_to_clear
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+
+    def bulk_load(self, name, model_class, build):
+        """
+        Читает CSV потоком и вставляет объекты пачками по SEED_CHUNK_SIZE.
+        build(i, row) строит объект по номеру строки (он же id) и строке.
+        """
+        rows = DictReader(self.open_file(name))
+        objs = (build(i, row) for i, row in enumerate(rows, start=1))
+        count = 0
+        while True:
+            chunk = list(islice(objs, SEED_CHUNK_SIZE))
+            if not chunk:
+                return count
+            model_class.objects.bulk_create(chunk)
+            count += len(chunk)
 
     def open_file(self, name):
         return open(
@@ -60,22 +97,18 @@ class Command(BaseCommand):
 
     def load_users(self):
         print("Loading Users")
-        password = settings.SEED_USERS_PASSWORD
-        i = 1
-        for row in DictReader(self.open_file("users")):
-            user = User(
-                id=i,
-                username=row["username"],
-                email=f'{row["username"]}@gmail.com',
-                first_name=row["first_name"],
-                last_name=row["last_name"],
-                avatar=os.path.join(f'avatars/{row["username"]}.png'),
-            )
-            user.set_password(password)
-            self.try_save(user, "user")
-            i += 1
-        User.objects.create_superuser(
+        password = make_password(settings.SEED_USERS_PASSWORD)
+        count = self.bulk_load("users", User, lambda i, row: User(
             id=i,
+            username=row["username"],
+            email=f'{row["username"]}@gmail.com',
+            first_name=row["first_name"],
+            last_name=row["last_name"],
+            avatar=f'avatars/{row["username"]}.png',
+            password=password,
+        ))
+        User.objects.create_superuser(
+            id=count + 1,
             username=settings.ADMIN_USERNAME,
             email=settings.ADMIN_EMAIL,
             password=settings.ADMIN_PASSWORD,
@@ -83,102 +116,87 @@ class Command(BaseCommand):
 
     def load_ingredients(self):
         print("Loading Ingredients")
-        i = 1
-        for row in DictReader(self.open_file("ingredients")):
-            ingredient = Ingredient(
-                id=i,
-                name=row["name"],
-                measurement_unit=row["measurement_unit"]
-            )
-            self.try_save(ingredient, "ingredient")
-            i += 1
+        self.bulk_load("ingredients", Ingredient, lambda i, row: Ingredient(
+            id=i,
+            name=row["name"],
+            measurement_unit=row["measurement_unit"]
+        ))
 
     def load_tags(self):
         print("Loading Tags")
-        i = 1
-        for row in DictReader(self.open_file("tags")):
-            tag = Tag(
-                id=i,
-                name=row["name"],
-                slug=row["slug"]
-            )
-            self.try_save(tag, "tag")
-            i += 1
+        self.bulk_load("tags", Tag, lambda i, row: Tag(
+            id=i,
+            name=row["name"],
+            slug=row["slug"]
+        ))
 
     def load_recipes(self):
         print("Loading Recipes")
-        i = 1
-        for row in DictReader(self.open_file("recipes")):
-            recipe = Recipe(
-                id=i,
-                name=row["name"],
-                cooking_time=row["cooking_time"],
-                author_id=row["author"],
-                text=row["text"],
-                image=f'recipes/{row["image_name"]}.png',
-            )
-            self.try_save(recipe, "recipe")
-            i += 1
+        self.bulk_load("recipes", Recipe, lambda i, row: Recipe(
+            id=i,
+            name=row["name"],
+            cooking_time=row["cooking_time"],
+            author_id=row["author"],
+            text=row["text"],
+            image=f'recipes/{row["image_name"]}.png',
+        ))
 
     def load_recipe_ingredients(self):
         print("Loading Recipe Ingredients")
-        i = 1
-        for row in DictReader(self.open_file("recipe_ingredients")):
-            recipe_ingredient = RecipeIngredient(
+        self.bulk_load(
+            "recipe_ingredients",
+            RecipeIngredient,
+            lambda i, row: RecipeIngredient(
                 id=i,
                 recipe_id=row["recipe"],
                 ingredient_id=row["ingredient"],
                 amount=row["amount"],
             )
-            self.try_save(recipe_ingredient, "recipe_ingredient")
-            i += 1
+        )
 
     def load_recipe_tags(self):
         print("Loading Recipe Tags")
-        i = 1
-        for row in DictReader(self.open_file("recipe_tags")):
-            recipe_tag = RecipeTag(
-                id=i,
-                recipe_id=row["recipe"],
-                tag_id=row["tag"])
-            self.try_save(recipe_tag, "recipe_tag")
-            i += 1
+        self.bulk_load("recipe_tags", RecipeTag, lambda i, row: RecipeTag(
+            id=i,
+            recipe_id=row["recipe"],
+            tag_id=row["tag"]
+        ))
 
     def load_user_favorite_recipes(self):
         print("Loading User favorite recipes")
-        i = 1
-        for row in DictReader(self.open_file("users_favorite_recipes")):
-            user_favorite_recipe = UserFavoriteRecipes(
+        self.bulk_load(
+            "users_favorite_recipes",
+            UserFavoriteRecipes,
+            lambda i, row: UserFavoriteRecipes(
                 id=i,
                 user_id=row["user"],
                 recipe_id=row["recipe"]
             )
-            self.try_save(user_favorite_recipe, "user_favorite_recipe")
-            i += 1
+        )
 
     def load_user_shopping_cart(self):
-        print("Loading Users favorite recipes")
-        i = 1
-        for row in DictReader(self.open_file("users_shopping_carts")):
-            user_shopping_cart = UserShoppingCart(
+        print("Loading Users shopping carts")
+        self.bulk_load(
+            "users_shopping_carts",
+            UserShoppingCart,
+            lambda i, row: UserShoppingCart(
                 id=i,
                 user_id=row["user"],
                 recipe_id=row["recipe"]
             )
-            self.try_save(user_shopping_cart, "user_shopping_cart")
-            i += 1
+        )
 
     def load_subscriptions(self):
-        print("Loading Users shopping carts")
-        i = 1
-        for row in DictReader(self.open_file("subscriptions")):
-            subscription = Subscription(
+        print("Loading Subscriptions")
+        self.bulk_load(
+            "subscriptions",
+            Subscription,
+            lambda i, row: Subscription(
                 id=i,
                 user_id=row["user"],
                 following_id=row["following"]
             )
-            self.try_save(subscription, "subscription")
-            i += 1
+        )
 
     def update_intial_ids(self):
         '''
@@ -191,6 +209,7 @@ class Command(BaseCommand):
             'recipes_recipe',
             'recipes_recipeingredient',
             'recipes_recipetag',
+            'recipes_shoppinglistitem',
             'recipes_subscription',
             'recipes_tag',
             'recipes_user',
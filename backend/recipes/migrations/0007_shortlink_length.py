@@ -0,0 +1,18 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_shopping_list_item'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shortlink',
+            name='link',
+            field=models.CharField(max_length=10, unique=True),
+        ),
+    ]
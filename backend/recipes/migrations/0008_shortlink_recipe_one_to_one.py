@@ -0,0 +1,31 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Min
+
+
+def drop_duplicate_links(apps, schema_editor):
+    ShortLink = apps.get_model('recipes', 'ShortLink')
+    keep = (
+        ShortLink.objects.values('recipe_id')
+        .annotate(first_id=Min('id'))
+        .values_list('first_id', flat=True)
+    )
+    ShortLink.objects.exclude(id__in=list(keep)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_shortlink_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_links, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='shortlink',
+            name='recipe',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='short_link', to='recipes.recipe'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.3 on 2026-10-17 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_shortlink_recipe_one_to_one'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='built_variants',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Изображение с готовыми копиями'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='built_variants',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Аватар с готовыми копиями'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+SEQUENCES = ('response_cache_hits_seq', 'response_cache_misses_seq')
+
+
+def create_sequences(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sequence in SEQUENCES:
+            schema_editor.execute(
+                f'CREATE SEQUENCE IF NOT EXISTS {sequence}'
+            )
+
+
+def drop_sequences(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sequence in SEQUENCES:
+            schema_editor.execute(f'DROP SEQUENCE IF EXISTS {sequence}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_pantry_change_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sequences, drop_sequences),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
-from django.db import models
-from django.db.models import Count, Exists, OuterRef, Prefetch
+from django.contrib.postgres.search import SearchVector, SearchVectorField
+from django.db import connection, models
+from django.db.models import Exists, F, OuterRef, Prefetch, Window
+from django.db.models.functions import RowNumber
 
 
 class DetailedUserManager(BaseUserManager):
@@ -15,17 +17,8 @@ class DetailedUserManager(BaseUserManager):
             )
         )
 
-    def subscribed_with_recipes(self, user):
-        return (
-            self.is_subscribed(user)
-            .filter(is_subscribed=True)
-            .prefetch_related(
-                Prefetch(
-                    'recipes',
-                    queryset=Recipe.objects.order_by('-pub_date'))
-            )
-            .annotate(recipes_count=Count('recipes'))
-        )
+    def subscribed(self, user):
+        return self.is_subscribed(user).filter(is_subscribed=True)
 
 
 class CustomUserAccountManager(BaseUserManager):
@@ -62,6 +55,19 @@ class User(AbstractUser):
     role = models.CharField(default='user', max_length=10, blank=False)
     is_staff = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
+    recipes_count = models.PositiveIntegerField(
+        'Число рецептов',
+        default=0,
+        editable=False)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков',
+        default=0,
+        editable=False)
+    built_variants = models.CharField(
+        'Аватар с готовыми копиями',
+        max_length=100,
+        blank=True,
+        editable=False)
 
     def create_superuser(self, username, email, password, **extrafields):
         extrafields.setdefault('role', 'admin')
@@ -110,26 +116,47 @@ class Ingredient(models.Model):
 
 
 class DetailedRecipeManager(models.Manager):
-    def annotate_extra_info(self, user):
-        query = self.prefetch_related(
+    def with_details(self):
+        return self.select_related('author').prefetch_related(
             'tags',
             Prefetch('recipeingredient_set', RecipeIngredient.detailed.all())
         )
-        user = user if user.is_authenticated else None
-        author = Prefetch('author', queryset=User.detailed.is_subscribed(user))
-        return query.prefetch_related(author).annotate(
-            is_favorited=Exists(
-                UserFavoriteRecipes.objects.filter(
-                    recipe_id=OuterRef('pk'),
-                    user=user
-                )
-            ),
-            is_in_shopping_cart=Exists(
-                UserShoppingCart.objects.filter(
-                    recipe_id=OuterRef('pk'),
-                    user=user
-                )
-            ),
+
+    def latest_by_authors(self, author_ids, limit=None):
+        """
+        Последние рецепты авторов одним оконным запросом: не больше limit
+        на каждого автора, от новых к старым.
+        """
+        ordering = (F('pub_date').desc(), F('id').desc())
+        query = self.filter(author_id__in=author_ids).order_by(*ordering)
+        if limit is None:
+            return query
+        sql, params = query.annotate(
+            row_number=Window(
+                RowNumber(),
+                partition_by=(F('author_id'),),
+                order_by=ordering,
+            )
+        ).query.sql_with_params()
+        return self.raw(
+            f'SELECT * FROM ({sql}) AS ranked WHERE row_number <= %s '
+            'ORDER BY pub_date DESC, id DESC',
+            (*params, limit),
+        )
+
+
+SEARCH_CONFIG = 'russian'
+
+
+class RecipeQuerySet(models.QuerySet):
+    def update_search_vector(self):
+        if connection.vendor != 'postgresql':
+            return 0
+        return self.update(
+            search_vector=(
+                SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+            )
         )
 
 
@@ -166,17 +193,47 @@ class Recipe(models.Model):
         through='UserFavoriteRecipes',
         related_name='favorited_recipes',
     )
-
-    objects = models.Manager()
+    favorites_count = models.PositiveIntegerField(
+        'Число добавлений в избранное',
+        default=0,
+        editable=False)
+    cart_count = models.PositiveIntegerField(
+        'Число добавлений в список покупок',
+        default=0,
+        editable=False)
+    built_variants = models.CharField(
+        'Изображение с готовыми копиями',
+        max_length=100,
+        blank=True,
+        editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
     detailed = DetailedRecipeManager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='recipe_author_pub_date_idx'
+            ),
+        )
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'name', 'text'} & set(update_fields):
+            Recipe.objects.filter(pk=self.pk).update_search_vector()
+
 
 class DetaiedRecipeManager(models.Manager):
     def get_queryset(self):
@@ -266,6 +323,29 @@ class UserShoppingCart(models.Model):
         return f'{self.user}: {self.recipe}'
 
 
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    class Meta:
+        unique_together = ('user', 'ingredient')
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient}, {self.amount}'
+
+
 class Subscription(models.Model):
     user = models.ForeignKey(
         User,
@@ -290,5 +370,7 @@ class Subscription(models.Model):
 
 
 class ShortLink(models.Model):
-    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
-    link = models.CharField(max_length=5, unique=True)
+    recipe = models.OneToOneField(
+        Recipe, on_delete=models.CASCADE, related_name='short_link'
+    )
+    link = models.CharField(max_length=10, unique=True)